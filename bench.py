@@ -0,0 +1,239 @@
+import argparse                                                         # параметры замеров
+import contextlib                                                       # перенаправление вывода команд
+import json                                                             # машиночитаемый результат
+import os
+import platform
+import random
+import resource                                                         # пиковый RSS процесса
+import subprocess                                                       # каждый замер — в отдельном процессе
+import sys
+import tempfile
+import time
+
+
+IMAGES = {                                                              # готовые наборы параметров vfs_gen.py
+    'small': ['--depth', '3', '--fanout', '5', '--files', '5'],                         # ~1 тыс. узлов
+    'medium': ['--depth', '4', '--fanout', '8', '--files', '16'],                       # ~80 тыс. узлов
+    'large': ['--depth', '5', '--fanout', '10', '--files', '8', '--max-nodes', '1000000'],  # ~1 млн узлов
+}
+MODES = ('cold', 'snapshot', 'lazy')                                    # разбор XML, загрузка из снимка, ленивое монтирование
+
+
+def percentiles(samples):
+    """
+    Сводка по задержкам в микросекундах: число, среднее, p50, p90, p99, максимум.
+    """
+    samples = sorted(samples)
+    if not samples:
+        return {'count': 0}
+
+    def at(p):
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+    return {'count': len(samples), 'mean_us': sum(samples) / len(samples),
+            'p50_us': at(0.50), 'p90_us': at(0.90), 'p99_us': at(0.99), 'max_us': samples[-1]}
+
+
+def sample_paths(main, limit, rng):
+    """
+    Случайная выборка (не больше limit) путей папок и файлов дерева — обходом с резервуарной выборкой.
+    """
+    folders, files = [], []
+    seen = [0, 0]
+    stack = [['root']]
+    while stack:
+        parts = stack.pop()
+        folder = main.get_folder(parts)
+        for name, node in folder.children.items():
+            kind = 0 if isinstance(node, main.FolderNode) else 1
+            bucket = folders if kind == 0 else files
+            seen[kind] += 1
+            if len(bucket) < limit:
+                bucket.append(parts + [name])
+            else:
+                slot = rng.randrange(seen[kind])
+                if slot < limit:
+                    bucket[slot] = parts + [name]
+            if kind == 0:
+                stack.append(parts + [name])
+    return folders or [['root']], files
+
+
+def timed(samples, func, *args):
+    started = time.perf_counter_ns()
+    func(*args)
+    samples.append((time.perf_counter_ns() - started) / 1000)
+
+
+def run_worker(vfs_path, mode, iterations, cache_dir, seed):
+    """
+    Один замер в текущем процессе: загрузка VFS, задержки команд и скорость скрипта.
+    Возвращает словарь результатов.
+    """
+    import main                                                         # импортируется здесь: в родительском процессе он не нужен
+
+    main.params = {'vfs_path': os.path.abspath(vfs_path), 'prompt': None, 'script_path': None, 'quiet': True,
+                   'lazy': mode == 'lazy', 'compact_dirs': 0, 'journal': False, 'cache': mode == 'snapshot',
+                   'cache_dir': cache_dir, 'blob_dir': None, 'undo_depth': 0, 'vfs': None,
+                   'current_working_directory': ['root']}
+    main.command_history = []
+
+    started = time.perf_counter()
+    main.params['vfs'] = main.load_vfs()
+    load_seconds = time.perf_counter() - started
+    if iterations and mode == 'snapshot' and main.vfs_source['kind'] != 'snapshot':
+        sys.exit(f"bench: {vfs_path}: в режиме snapshot дерево загружено не из снимка")  # иначе замер молча повторяет cold
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss     # до выборки путей: она монтирует ленивое дерево
+    if not iterations:                                                  # прогрев: только создать снимок или индекс папок
+        return {'load_seconds': load_seconds, 'peak_rss_kb': peak_rss_kb}
+
+    rng = random.Random(seed)
+    folders, files = sample_paths(main, iterations, rng)
+    commands = {name: [] for name in ('get_folder', 'ls', 'cd', 'mv', 'chown')}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(iterations):
+            folder = rng.choice(folders)
+            main.path_cache.clear()                                     # холодный путь: обход от корня
+            timed(commands['get_folder'], main.get_folder, folder)
+            main.params['current_working_directory'] = folder
+            timed(commands['ls'], main.do_command, 'ls')
+            timed(commands['cd'], main.do_command, 'cd ' + main.format_path(rng.choice(folders)))
+            if files:
+                file = main.format_path(rng.choice(files))
+                timed(commands['mv'], main.do_command, f'mv {file} {file}.bak')
+                main.do_command(f'mv {file}.bak {file}')
+                timed(commands['chown'], main.do_command, f'chown bench {file}')
+
+        script_lines = []
+        for _ in range(iterations * 10):
+            script_lines.append('cd ' + main.format_path(rng.choice(folders)))
+            script_lines.append('ls')
+        with tempfile.NamedTemporaryFile('w', suffix='.sh', delete=False) as script:
+            script.write('\n'.join(script_lines) + '\n')
+        main.params['script_path'] = script.name
+        main.params['current_working_directory'] = ['root']
+        try:
+            with contextlib.redirect_stderr(devnull):
+                started = time.perf_counter()
+                main.run_script()
+                script_seconds = time.perf_counter() - started
+        finally:
+            os.unlink(script.name)
+
+    return {
+        'load_seconds': load_seconds,
+        'peak_rss_kb': peak_rss_kb,
+        'commands': {name: percentiles(samples) for name, samples in commands.items()},
+        'script': {'commands': len(script_lines), 'seconds': script_seconds,
+                   'commands_per_second': len(script_lines) / script_seconds if script_seconds else 0.0},
+    }
+
+
+def measure(vfs_path, mode, iterations, cache_dir, seed):
+    """
+    Запускает замер в отдельном процессе (чистый пиковый RSS) и возвращает его результат.
+    Перед замерами снимка и ленивого режима отдельный прогон создает снимок и индекс папок.
+    """
+    def command(count):
+        return [sys.executable, os.path.abspath(__file__), '--worker', '--vfs', vfs_path, '--mode', mode,
+                '--iterations', str(count), '--cache-dir', cache_dir, '--seed', str(seed)]
+
+    if mode in ('snapshot', 'lazy'):
+        subprocess.run(command(0), check=True, stdout=subprocess.DEVNULL)
+    result = subprocess.run(command(iterations), check=True, stdout=subprocess.PIPE, text=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def generate(name, workdir):
+    """
+    Образ из набора IMAGES (генерируется один раз и переиспользуется).
+    """
+    path = os.path.join(workdir, f'{name}.xml')
+    if not os.path.exists(path):
+        generator = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vfs_gen.py')
+        subprocess.run([sys.executable, generator, '--out', path] + IMAGES[name], check=True, stderr=subprocess.DEVNULL)
+    return path
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, threshold):
+    """
+    Печатает отношения метрик текущего прогона к базовому. Возвращает число регрессий:
+    метрик, выросших больше чем в 1 + threshold раз (для скорости скрипта — упавших).
+    """
+    regressions = 0
+    for key, result in current['results'].items():
+        base = baseline['results'].get(key)
+        if base is None:
+            continue
+        pairs = [('load_seconds', base['load_seconds'], result['load_seconds']),
+                 ('peak_rss_kb', base['peak_rss_kb'], result['peak_rss_kb']),
+                 ('script cmd/s', result['script']['commands_per_second'], base['script']['commands_per_second'])]
+        for name, stats in result['commands'].items():
+            for metric in ('p50_us', 'p99_us'):
+                if metric in stats and metric in base['commands'].get(name, {}):
+                    pairs.append((f'{name} {metric}', base['commands'][name][metric], stats[metric]))
+        for metric, old, new in pairs:                                  # для скорости пары переставлены: рост — тоже регрессия
+            ratio = new / old if old else 1.0
+            mark = ''
+            if ratio > 1 + threshold:
+                mark = '  <-- регрессия'
+                regressions += 1
+            print(f'{key:20} {metric:20} {ratio:6.2f}x{mark}')
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Замеры производительности оболочки VFS')
+    parser.add_argument('--images', default='small,medium')  # наборы из IMAGES через запятую
+    parser.add_argument('--vfs', action='append', default=[])  # готовые XML VFS (можно несколько раз)
+    parser.add_argument('--modes', default=','.join(MODES))  # режимы загрузки через запятую
+    parser.add_argument('--iterations', type=int, default=200)  # сколько раз замерять каждую команду
+    parser.add_argument('--seed', type=int, default=1)      # зерно выборки путей
+    parser.add_argument('--workdir', default='bench_data')  # каталог для сгенерированных образов и снимков
+    parser.add_argument('--out', default=None)              # файл для результата JSON (по умолчанию stdout)
+    parser.add_argument('--compare', default=None)          # JSON прошлого прогона: сравнить и вернуть код 1 при регрессии
+    parser.add_argument('--threshold', type=float, default=0.2)  # допустимое ухудшение при сравнении (0.2 — на 20%)
+    parser.add_argument('--worker', action='store_true')   # служебный: один замер в этом процессе
+    parser.add_argument('--mode', default='cold')           # служебный: режим замера для --worker
+    parser.add_argument('--cache-dir', default=None)        # служебный: каталог снимков для --worker
+
+    args = parser.parse_args()
+    if args.worker:
+        print(json.dumps(run_worker(args.vfs[0], args.mode, args.iterations, args.cache_dir, args.seed)))
+        sys.exit(0)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    cache_dir = os.path.abspath(os.path.join(args.workdir, 'cache'))
+    os.makedirs(cache_dir, exist_ok=True)
+    images = [(name, generate(name, args.workdir)) for name in args.images.split(',') if name]
+    images += [(os.path.basename(path), path) for path in args.vfs]
+
+    report = {'revision': git_revision(), 'python': platform.python_version(), 'platform': platform.platform(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'iterations': args.iterations, 'results': {}}
+    for name, path in images:
+        for mode in args.modes.split(','):
+            result = measure(path, mode, args.iterations, cache_dir, args.seed)
+            report['results'][f'{name}/{mode}'] = result
+            print(f"{name}/{mode}: загрузка {result['load_seconds']:.3f} с, RSS {result['peak_rss_kb'] // 1024} МБ, "
+                  f"скрипт {result['script']['commands_per_second']:.0f} команд/с", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.threshold):
+            sys.exit(1)
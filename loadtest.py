@@ -0,0 +1,162 @@
+import argparse                                                         # параметры командной строки
+import asyncio                                                          # параллельные сессии
+import json                                                             # вывод результата для тестов и скриптов
+import os
+import shutil
+import subprocess                                                       # сервер для проверки (--spawn)
+import sys
+import tempfile                                                         # каталог для Unix-сокета сервера
+import time                                                             # замер задержек
+
+
+DEFAULT_COMMANDS = ['ls', 'cd ~', 'ls -l', 'cd /', 'whoami', 'du -s /', 'history']  # только чтение: дерево не меняется
+HOST_COMMANDS = ['compact', 'profile -o loadtest.prof ls', 'sandbox run script1.sh']  # клиентам сервера эти команды недоступны
+
+
+async def connect(address):
+    """
+    Подключение к серверу main.py --serve: 'хост:порт' (TCP) или 'unix:путь' (Unix-сокет).
+    """
+    if address.startswith('unix:'):
+        return await asyncio.open_unix_connection(address[5:])
+    host, _, port = address.rpartition(':')
+    return await asyncio.open_connection(host or '127.0.0.1', int(port))
+
+
+async def run_session(address, commands, repeat, latencies):
+    """
+    Одна сессия: repeat раз выполняет список команд, задержку каждой команды дописывает в latencies.
+    Возвращает число ответов, в которых сервер сообщил об ошибке.
+    """
+    reader, writer = await connect(address)
+    errors = 0
+    try:
+        await reader.readuntil(b'\0')                                   # первое приглашение
+        for _ in range(repeat):
+            for line in commands:
+                start = time.perf_counter()
+                writer.write(line.encode('utf-8') + b'\n')
+                reply = await reader.readuntil(b'\0')
+                latencies.append(time.perf_counter() - start)
+                if 'команда не найдена'.encode('utf-8') in reply or 'Внутренняя ошибка'.encode('utf-8') in reply:
+                    errors += 1
+        writer.write(b'exit\n')
+        await reader.readuntil(b'\0')
+    finally:
+        writer.close()
+    return errors
+
+
+async def run_load_async(address, sessions, commands, repeat):
+    latencies = []
+    start = time.perf_counter()
+    errors = await asyncio.gather(*(run_session(address, commands, repeat, latencies) for _ in range(sessions)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+
+    return {
+        'sessions': sessions,
+        'commands': len(latencies),
+        'errors': sum(errors),
+        'seconds': elapsed,
+        'commands_per_second': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(0.50),
+        'p99_ms': percentile(0.99),
+        'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+    }
+
+
+def run_load(address, sessions=10, commands=DEFAULT_COMMANDS, repeat=100):
+    """
+    Нагрузочный прогон: sessions одновременных сессий, каждая repeat раз выполняет commands.
+    Возвращает словарь: число команд и ошибок, время, команд в секунду, задержки p50/p99/max (мс).
+    """
+    return asyncio.run(run_load_async(address, sessions, commands, repeat))
+
+
+async def check_host_commands(address):
+    """
+    Отправляет серверу команды, которые трогают файлы хоста (HOST_COMMANDS).
+    Возвращает список команд, которые сервер не отклонил.
+    """
+    reader, writer = await connect(address)
+    accepted = []
+    try:
+        await reader.readuntil(b'\0')
+        for line in HOST_COMMANDS:
+            writer.write(line.encode('utf-8') + b'\n')
+            reply = await reader.readuntil(b'\0')
+            if 'недоступно в сессии сервера'.encode('utf-8') not in reply:
+                accepted.append(line)
+        writer.write(b'exit\n')
+        await reader.readuntil(b'\0')
+    finally:
+        writer.close()
+    return accepted
+
+
+def spawn_server(vfs_path, address):
+    """
+    Запускает main.py --serve address с VFS vfs_path (рабочий каталог — каталог VFS)
+    и ждет, пока сервер начнет принимать сессии.
+    """
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    server = subprocess.Popen([sys.executable, main_path, '--vfs', vfs_path, '--no-cache', '--serve', address],
+                              stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(vfs_path))
+    for line in server.stdout:
+        if line.startswith('Сервер VFS'):
+            return server
+    server.wait()
+    sys.exit(f"loadtest: сервер не запустился (код {server.returncode})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Нагрузочный клиент для main.py --serve')
+    parser.add_argument('--connect', default=None)         # адрес сервера: хост:порт или unix:путь
+    parser.add_argument('--spawn', default=None)           # путь к VFS: запустить свой сервер на Unix-сокете и проверить, что ошибок нет
+    parser.add_argument('--sessions', type=int, default=10)  # число одновременных сессий
+    parser.add_argument('--repeat', type=int, default=100)  # сколько раз каждая сессия выполняет список команд
+    parser.add_argument('--commands', default=None)        # файл со списком команд (по одной в строке), по умолчанию DEFAULT_COMMANDS
+    parser.add_argument('--json', action='store_true')     # вывести результат одной строкой JSON
+
+    args = parser.parse_args()
+    commands = DEFAULT_COMMANDS
+    if args.commands is not None:
+        with open(args.commands, encoding='utf-8') as f:
+            commands = [line.strip() for line in f if line.strip()]
+
+    if (args.connect is None) == (args.spawn is None):
+        parser.error('нужен ровно один из параметров --connect и --spawn')
+
+    server = None
+    accepted = []
+    if args.spawn is not None:                                          # проверка: свой сервер, нагрузка без ошибок
+        workdir = tempfile.mkdtemp(prefix='loadtest-')
+        args.connect = f"unix:{os.path.join(workdir, 'vfs.sock')}"
+        vfs_copy = shutil.copy(args.spawn, workdir)                     # если проверка не пройдет, compact перепишет только копию
+        server = spawn_server(vfs_copy, args.connect)
+    try:
+        result = run_load(args.connect, args.sessions, commands, args.repeat)
+        if server is not None:
+            accepted = asyncio.run(check_host_commands(args.connect))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print(f"Сессий: {result['sessions']}, команд: {result['commands']}, ошибок: {result['errors']}")
+        print(f"Время: {result['seconds']:.3f} с ({result['commands_per_second']:.0f} команд/с)")
+        print(f"Задержка: p50 {result['p50_ms']:.2f} мс, p99 {result['p99_ms']:.2f} мс, max {result['max_ms']:.2f} мс")
+    if server is not None:
+        for line in accepted:
+            print(f"loadtest: сервер выполнил команду клиента, трогающую файлы хоста: {line}")
+        if result['errors'] or accepted:
+            sys.exit(1)
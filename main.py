@@ -4,8 +4,36 @@ import socket                                                           # пол
 import getpass                                                          # получить имя текущего пользователя
 import sys
 import argparse                                                         # для разбора параметров командной строки (--vfs, --prompt, --script)
+import io                                                               # сбор вывода команд сессии сервера
+import contextlib                                                       # перенаправление вывода скрипта в буфер
+import functools                                                        # кэширование имени пользователя и хоста
+import importlib                                                        # подключение модулей команд и ленивых обработчиков
+import time                                                             # замер скорости выполнения скрипта
+import atexit                                                           # отчет --profile при завершении оболочки
 import xml.etree.ElementTree as ET                                      # парсинг XML
+import xml.parsers.expat                                                # потоковый разбор XML с позициями в байтах
 import base64                                                           # для декодирования base64
+from collections import OrderedDict                                     # LRU-кэш разрешенных путей
+import hashlib                                                          # хеш содержимого XML для ключа снимка
+import bisect                                                           # поиск по отсортированному списку имен детей
+import fnmatch                                                          # шаблоны имен в find -name, ls, mv, chown
+import itertools                                                        # страница совпадений шаблона в ls
+import mmap                                                             # отображение XML VFS в память для ленивого монтирования
+import re                                                               # разбор разметки XML при ленивом монтировании
+import struct                                                           # бинарный формат индекса-спутника
+import zlib                                                             # crc32 записей журнала изменений
+from array import array                                                 # компактное хранение смещений в индексе
+from xml.sax.saxutils import unescape, quoteattr                        # раскрытие и экранирование XML-сущностей в именах
+
+
+@functools.lru_cache(maxsize=None)
+def system_identity():
+    """
+    Имя пользователя и хоста системы. Запрашиваются один раз за работу эмулятора:
+    приглашение строится на каждой строке скрипта, а системные вызовы тут не бесплатные.
+    """
+    return getpass.getuser(), socket.gethostname()
+
 
 def make_invite_line():
     """
@@ -15,8 +43,7 @@ def make_invite_line():
     if params['prompt'] is not None:                                    # если есть пользовательский prompt
         return params['prompt'] + ' '                                   # возвращаем пользовательскую строку
 
-    user = getpass.getuser()                                            # получение имя юзера системы
-    host = socket.gethostname()                                         # получение имя хоста системы (компа)
+    user, host = system_identity()                                      # имя юзера и хоста системы (компа)
 
     current_path = params.get('current_working_directory', ['root'])    # получение текущего пути, если None - root
 
@@ -58,143 +85,2559 @@ def do_command(line):
         print(e)
         return False
 
-    if not args:                                                        # ничего не ввели
-        return True
+    return execute_command(args)
+
+
+def execute_command(args):
+    """
+    Выполняет уже разобранную команду args (список argv): ищет ее в реестре COMMANDS.
+    Возвращает True, если команда выполнена успешно и False, если произошла ошибка.
+    """
+    if not args:                                                        # ничего не ввели
+        return True
+
+    command = COMMANDS.get(args[0])                                     # поиск обработчика по имени за O(1)
+    if command is None:                                                 # если неизвестная команда — сообщаем об ошибке
+        print(f"{args[0]}: команда не найдена")
+        return False
+    return command.run(args)
+
+
+# ---------------------------------------------------------------------------
+# Реестр команд. Встроенные команды регистрируются декоратором command(...)
+# у своих обработчиков, сторонние модули — вызовом register_command(...)
+# при импорте (см. load_plugins и параметр --plugin).
+# ---------------------------------------------------------------------------
+
+COMMANDS = {}                                                           # имя или псевдоним команды -> Command
+counters = {                                                            # счетчики работы оболочки (stats)
+    'commands': 0,                                                      # сколько команд выполнено
+    'path_hits': 0,                                                     # разрешений пути из кэша
+    'path_walks': 0,                                                    # разрешений с обходом дерева
+    'path_steps': 0,                                                    # пройдено узлов при обходах
+    'output_bytes': 0,                                                  # записано символов буферизованным выводом скрипта
+    'output_ns': 0,                                                     # и сколько заняла запись
+}
+command_stats = {}                                                      # имя команды -> [вызовов, суммарное время в нс, гистограмма задержек]
+HISTOGRAM_BUCKETS = 24                                                  # корзина k — задержки меньше 2**k мкс, последняя — все остальные
+
+
+class Command:
+    """
+    Команда оболочки: обработчик и спецификация аргументов.
+    handler — функция handler(args) или строка 'модуль:функция' — тогда модуль
+    импортируется только при первом вызове команды.
+    min_args/max_args — допустимое число аргументов после имени (max_args=None — без ограничения).
+    usage — сообщение при нехватке аргументов, too_many — при избытке
+    (в сообщения подставляется {count} — сколько аргументов передано).
+    """
+    __slots__ = ('name', 'handler', 'min_args', 'max_args', 'usage', 'too_many', 'aliases')
+
+    def __init__(self, name, handler, min_args=0, max_args=None, usage=None, too_many=None, aliases=()):
+        self.name = name
+        self.handler = handler
+        self.min_args = min_args
+        self.max_args = max_args
+        self.usage = usage or f"{name}: неверное число аргументов"
+        self.too_many = too_many or self.usage
+        self.aliases = tuple(aliases)
+
+    def check_args(self, args):
+        """
+        Возвращает сообщение об ошибке, если число аргументов не подходит, иначе None.
+        """
+        count = len(args) - 1
+        if count < self.min_args:
+            return self.usage.format(count=count)
+        if self.max_args is not None and count > self.max_args:
+            return self.too_many.format(count=count)
+        return None
+
+    def get_handler(self):
+        """
+        Обработчик команды; ленивый ('модуль:функция') импортируется при первом обращении.
+        """
+        if isinstance(self.handler, str):
+            module_name, _, attr = self.handler.partition(':')
+            self.handler = getattr(importlib.import_module(module_name), attr)
+        return self.handler
+
+    def run(self, args):
+        """
+        Проверяет аргументы и вызывает обработчик. Неверное число аргументов —
+        сообщение без остановки скрипта (как и раньше, когда проверка была в обработчиках).
+        Обработчик может вернуть False, чтобы сообщить об ошибке выполнения.
+        """
+        counters['commands'] += 1
+        error = self.check_args(args)
+        if error is not None:
+            print(error)
+            return True
+        started = time.perf_counter_ns()
+        try:
+            return self.get_handler()(args) is not False
+        finally:                                                        # и для exit, который завершает оболочку через SystemExit
+            record_command(self.name, time.perf_counter_ns() - started)
+
+
+def register_command(name, handler=None, *, aliases=(), min_args=0, max_args=None, usage=None, too_many=None):
+    """
+    Регистрирует команду name (и ее псевдонимы) в реестре. Повторная регистрация заменяет команду.
+    Без handler возвращает декоратор. handler может быть строкой 'модуль:функция' (ленивая загрузка).
+    """
+    if handler is None:
+        return lambda func: register_command(name, func, aliases=aliases, min_args=min_args,
+                                             max_args=max_args, usage=usage, too_many=too_many)
+
+    command = Command(name, handler, min_args, max_args, usage, too_many, aliases)
+    for key in (name, *command.aliases):
+        COMMANDS[key] = command
+    return handler
+
+
+command = register_command                                              # короткое имя для декоратора встроенных команд
+
+
+def record_command(name, elapsed_ns):
+    """
+    Учитывает один вызов команды: счетчик, суммарное время и корзину гистограммы (степени двойки в микросекундах).
+    Стоит два сложения и запись в список — счетчики можно не выключать.
+    """
+    entry = command_stats.get(name)
+    if entry is None:
+        entry = command_stats[name] = [0, 0, [0] * HISTOGRAM_BUCKETS]
+    entry[0] += 1
+    entry[1] += elapsed_ns
+    entry[2][min((elapsed_ns // 1000).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+
+def load_plugins(module_names):
+    """
+    Импортирует сторонние модули команд. Модуль регистрирует свои команды
+    при импорте: import main; main.register_command('имя', обработчик, ...).
+    """
+    for module_name in module_names:
+        try:
+            importlib.import_module(module_name)
+        except Exception as e:                                          # битый модуль не должен ронять оболочку
+            print(f"Ошибка: не удалось загрузить модуль команд {module_name}: {e}")
+
+
+@command('exit', aliases=('quit',))
+def handle_exit(args):
+    """
+    exit — завершает работу оболочки
+    """
+    print("exit")
+    sys.exit(0)
+
+
+@command('conf-dump', max_args=1, usage='conf-dump: лишние аргументы: conf-dump [-s]')
+def handle_conf_dump(args):
+    """
+    conf-dump [-s] — служебная команда для вывода конфигурации
+    с -s — и счетчиков работы оболочки (как stats)
+    """
+    if len(args) > 1 and args[1] != '-s':
+        print(COMMANDS['conf-dump'].usage)
+        return False
+    for key, value in params.items():
+        print(f"{key} = {value}")
+    if len(args) > 1:
+        print_stats()
+
+
+class BufferedOutput:
+    """
+    Буферизованный приемник вывода: строки копятся в памяти и пишутся в поток
+    большими кусками (при переполнении буфера и в flush), а не по одной на print.
+    """
+
+    def __init__(self, stream, limit=1 << 16):
+        self.stream = stream
+        self.limit = limit                                              # сколько символов копить до записи
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.limit:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        started = time.perf_counter_ns()
+        if self.parts:
+            self.stream.write(''.join(self.parts))
+            counters['output_bytes'] += self.size
+            self.parts.clear()
+            self.size = 0
+        self.stream.flush()
+        counters['output_ns'] += time.perf_counter_ns() - started
+
+
+def compile_script(lines):
+    """
+    Компилирует строки скрипта в список операций (номер строки, строка, команда, argv).
+    Команда ищется в реестре при компиляции (None — неизвестная команда).
+    Пустые строки отбрасываются. Одинаковые строки разбираются один раз (кэш разбора).
+    Если строку разобрать нельзя, вместо argv в операции лежит SyntaxError —
+    ошибка сообщается, когда выполнение дойдет до этой строки.
+    """
+    parsed = {}                                                         # кэш разбора: строка -> argv или SyntaxError
+    program = []
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()                                             # убираем лишние пробелы и \n
+        if not line:                                                    # пропускаем пустые строки
+            continue
+        args = parsed.get(line)
+        if args is None:
+            try:
+                args = parse_command(line)
+            except SyntaxError as e:
+                args = e
+            parsed[line] = args
+        found = COMMANDS.get(args[0]) if isinstance(args, list) and args else None
+        program.append((lineno, line, found, args))
+    return program
+
+
+def run_compiled(line, found, args):
+    """
+    Выполняет одну операцию скомпилированного скрипта, как do_command выполняет строку.
+    """
+    command_history.append(line)                                        # добавляем команду в историю
+    if isinstance(args, SyntaxError):                                   # строку не удалось разобрать при компиляции
+        print(args)
+        return False
+    if not args:
+        return True
+    if found is None:
+        print(f"{args[0]}: команда не найдена")
+        return False
+    return found.run(args)
+
+
+def run_script():
+    """
+    Функция для выполнения стартового скрипта.
+    Скрипт читается целиком и компилируется (compile_script), вывод идет в один буфер.
+    При первой ошибке выполнение прекращается с указанием номера строки.
+    В тихом режиме (--quiet) приглашение со строкой команды не выводится.
+    По окончании в stderr выводится число выполненных команд и скорость (команд в секунду).
+    """
+    script_path = params["script_path"]
+
+    if not os.path.exists(script_path):                                 # если стартовый скрипт не найден по пути
+        print(f"Ошибка: файл скрипта по пути {script_path} не найден")  # вывод ошибки
+        return False
+
+    with open(script_path, "r") as script:                              # читаем файл скрипта за один проход
+        program = compile_script(script.read().splitlines())
+
+    quiet = params.get('quiet')
+    sink = BufferedOutput(sys.stdout)
+    executed = 0
+    started = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(sink):                          # весь вывод скрипта — в буфер
+            for lineno, line, found, args in program:
+                if not quiet:
+                    print(make_invite_line() + line)                    # вывод строки с промптом приглашения, чтобы выглядело как ввод пользователя
+                executed += 1
+                if not run_compiled(line, found, args):                        # если выполнение команды завершилось ошибкой
+                    print(f"Ошибка во время исполнения стартового скрипта (строка {lineno}).")
+                    return False
+        return True
+    finally:                                                            # в том числе при exit внутри скрипта
+        sink.flush()
+        elapsed = time.perf_counter() - started
+        rate = executed / elapsed if elapsed > 0 else 0.0
+        print(f"Скрипт: выполнено команд: {executed} за {elapsed:.3f} с ({rate:.0f} команд/с)", file=sys.stderr)
+
+
+class FileNode:
+    """
+    Файл VFS. blob — ссылка на содержимое в контентно-адресуемом хранилище blob_store
+    (файлы с одинаковым содержимым ссылаются на один Blob).
+    name и parent — имя узла и папка, в которой он лежит (по ним восстанавливается путь узла).
+    epoch — эпоха, в которую узел создан: узлы прошлых эпох общие с другими версиями дерева и не меняются.
+    """
+    __slots__ = ('owner', 'blob', 'name', 'parent', 'epoch')
+
+    def __init__(self, owner='root', blob=None, name=None, parent=None, epoch=0):
+        self.owner = sys.intern(owner)                                  # одинаковые имена владельцев хранятся одной строкой
+        self.blob = blob
+        self.name = name
+        self.parent = parent
+        self.epoch = epoch
+
+    def __repr__(self):
+        return f"FileNode(owner={self.owner!r})"
+
+
+class FolderNode:
+    """
+    Папка VFS. Дети хранятся в отдельном словаре имя -> узел, поэтому служебные поля
+    не пересекаются с именами файлов. span — начало папки в XML, пока она не смонтирована (ленивый режим).
+    name, parent и epoch — как у FileNode. totals — агрегаты поддерева (см. sum_totals), None — еще не посчитаны.
+    order — отсортированный список имен детей (см. sorted_names), None — еще не нужен.
+    """
+    __slots__ = ('owner', '_children', 'span', 'name', 'parent', 'totals', 'epoch', 'order')
+
+    def __init__(self, owner='root', span=None, name=None, parent=None, totals=None, epoch=0):
+        self.owner = sys.intern(owner)
+        self._children = {}
+        self.span = span
+        self.name = name
+        self.parent = parent
+        self.totals = totals
+        self.epoch = epoch
+        self.order = None
+
+    @property
+    def children(self):
+        """
+        Словарь детей папки. Ленивая папка монтируется при первом обращении.
+        """
+        if self.span is not None:
+            mount_folder(self)
+        return self._children
+
+    def __repr__(self):
+        if self.span is not None:
+            return f"FolderNode(owner={self.owner!r}, не смонтирована)"
+        return f"FolderNode(owner={self.owner!r}, детей: {len(self._children)})"
+
+
+class SortedChildren:
+    """
+    Компактное хранилище детей для очень больших плоских папок: два параллельных списка
+    (отсортированные имена и узлы) вместо словаря. Поиск — бинарный, O(log n),
+    вставка и удаление — сдвиг списка. Интерфейс повторяет используемую часть dict.
+    """
+    __slots__ = ('names', 'nodes')
+
+    def __init__(self, items=()):
+        pairs = sorted(items, key=lambda item: item[0])
+        self.names = [name for name, _ in pairs]
+        self.nodes = [node for _, node in pairs]
+
+    def _find(self, name):
+        i = bisect.bisect_left(self.names, name)
+        return i, i < len(self.names) and self.names[i] == name
+
+    def __contains__(self, name):
+        return self._find(name)[1]
+
+    def __getitem__(self, name):
+        i, found = self._find(name)
+        if not found:
+            raise KeyError(name)
+        return self.nodes[i]
+
+    def get(self, name, default=None):
+        i, found = self._find(name)
+        return self.nodes[i] if found else default
+
+    def __setitem__(self, name, node):
+        i, found = self._find(name)
+        if found:
+            self.nodes[i] = node
+        else:
+            self.names.insert(i, name)
+            self.nodes.insert(i, node)
+
+    def __delitem__(self, name):
+        i, found = self._find(name)
+        if not found:
+            raise KeyError(name)
+        del self.names[i]
+        del self.nodes[i]
+
+    def pop(self, name, *default):
+        i, found = self._find(name)
+        if not found:
+            if default:
+                return default[0]
+            raise KeyError(name)
+        del self.names[i]
+        return self.nodes.pop(i)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def keys(self):
+        return iter(self.names)
+
+    def values(self):
+        return iter(self.nodes)
+
+    def items(self):
+        return zip(self.names, self.nodes)
+
+    def copy(self):
+        copy = SortedChildren()
+        copy.names = list(self.names)
+        copy.nodes = list(self.nodes)
+        return copy
+
+
+class Blob:
+    """
+    Содержимое файла в хранилище blob_store, одно на все файлы с одинаковым содержимым.
+    key — хеш канонического base64 содержимого, refs — сколько файлов на него ссылается,
+    size — размер декодированного содержимого. Где лежат байты, говорит state:
+    'b64' — в data base64 (bytes) в памяти, 'xml' — в data диапазон base64 в отображенном XML,
+    'snapshot' — диапазон готовых байт в отображенном снимке, 'disk' — диапазон в файле
+    хранилища на диске (--blob-dir), 'raw' — в data декодированные байты в памяти.
+    """
+    __slots__ = ('key', 'refs', 'size', 'state', 'data')
+
+    def __init__(self, key, size, state, data):
+        self.key = key
+        self.refs = 0
+        self.size = size
+        self.state = state
+        self.data = data
+
+
+def base64_key(canonical):
+    """
+    Ключ blob по каноническому base64 (без пробельных символов).
+    """
+    return hashlib.blake2b(canonical, digest_size=16).digest()
+
+
+def base64_size(canonical):
+    """
+    Размер декодированного содержимого по каноническому base64 — без декодирования.
+    """
+    padding = len(canonical) - len(canonical.rstrip(b'='))
+    return max(len(canonical) * 3 // 4 - padding, 0)
+
+
+class BlobStore:
+    """
+    Контентно-адресуемое хранилище содержимого файлов: одинаковое содержимое хранится один раз,
+    файлы ссылаются на общий Blob, число ссылок считается в Blob.refs. Blob без ссылок удаляется.
+    Если задан каталог (--blob-dir), декодированное содержимое от DISK_BLOB_MIN байт пишется
+    в файл blobs.dat и читается через mmap, а не хранится в памяти процесса.
+    """
+    DISK_BLOB_MIN = 4096                                                # меньшие blob держать на диске невыгодно
+
+    def __init__(self):
+        self.blobs = {}                                                 # ключ -> Blob
+        self.files = 0                                                  # сколько файлов ссылается на blob
+        self.logical_bytes = 0                                          # суммарный размер всех файлов
+        self.stored_bytes = 0                                           # суммарный размер уникальных blob
+        self.disk_file = None
+        self.disk_map = None
+        self.disk_size = 0
+        self.decoded = 0                                                # сколько blob декодировано из base64
+        self.decode_ns = 0                                              # и сколько это заняло (нс)
+
+    def reset(self, disk_dir=None):
+        """
+        Очищает хранилище (новое дерево) и, если задан disk_dir, открывает файл blobs.dat в нем.
+        """
+        self.__init__()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self.disk_file = open(os.path.join(disk_dir, 'blobs.dat'), 'w+b')
+
+    def add(self, key, size, state, data):
+        """
+        Возвращает Blob с ключом key, создавая его, если его нет. Ссылку не учитывает.
+        """
+        blob = self.blobs.get(key)
+        if blob is None:
+            blob = self.blobs[key] = Blob(key, size, state, data)
+            self.stored_bytes += size
+        return blob
+
+    def intern(self, key, size, state, data):
+        """
+        То же, что add, и учитывает новую ссылку на blob.
+        """
+        blob = self.add(key, size, state, data)
+        self.retain(blob)
+        return blob
+
+    def intern_base64(self, encoded, span=None):
+        """
+        Blob по base64 из XML (bytes). Если передан span — base64 лежит в отображенном XML
+        по этому диапазону и в памяти не хранится.
+        """
+        canonical = b''.join(encoded.split())
+        if span is not None:
+            return self.intern(base64_key(canonical), base64_size(canonical), 'xml', span)
+        blob = self.intern(base64_key(canonical), base64_size(canonical), 'b64', canonical)
+        if blob.state == 'b64' and self.disk_file is not None and blob.size >= self.DISK_BLOB_MIN:
+            self.content(blob)                                          # крупное содержимое сразу уходит на диск
+        return blob
+
+    def retain(self, blob):
+        blob.refs += 1
+        self.files += 1
+        self.logical_bytes += blob.size
+
+    def release(self, blob):
+        blob.refs -= 1
+        self.files -= 1
+        self.logical_bytes -= blob.size
+        if blob.refs == 0:
+            del self.blobs[blob.key]
+            self.stored_bytes -= blob.size
+
+    def content(self, blob):
+        """
+        Декодированное содержимое blob. base64 декодируется при первом обращении,
+        результат остается в памяти или уходит в файл хранилища на диске.
+        """
+        state = blob.state
+        if state == 'raw':
+            return blob.data
+        if state == 'snapshot':
+            start, end = blob.data
+            return vfs_source['data'][start:end]
+        if state == 'disk':
+            return self.read_disk(*blob.data)
+        decoded = self.decode(blob)
+        if len(decoded) != blob.size:                                   # base64 был неканоническим — поправляем счетчики
+            self.stored_bytes += len(decoded) - blob.size
+            self.logical_bytes += (len(decoded) - blob.size) * blob.refs
+            blob.size = len(decoded)
+        if self.disk_file is not None and blob.size >= self.DISK_BLOB_MIN:
+            self.disk_file.seek(self.disk_size)
+            self.disk_file.write(decoded)
+            blob.state, blob.data = 'disk', (self.disk_size, self.disk_size + blob.size)
+            self.disk_size += blob.size
+        else:
+            blob.state, blob.data = 'raw', decoded
+        return decoded
+
+    def decode(self, blob):
+        """
+        Декодирует base64 blob (в состоянии 'b64' или 'xml'), не меняя сам blob.
+        """
+        started = time.perf_counter_ns()
+        if blob.state == 'xml':
+            start, end = blob.data
+            decoded = base64.b64decode(xml_text(vfs_source['data'][start:end]))
+        else:
+            decoded = base64.b64decode(blob.data)
+        self.decoded += 1
+        self.decode_ns += time.perf_counter_ns() - started
+        return decoded
+
+    def peek(self, blob):
+        """
+        Содержимое blob для однократного чтения (запись снимка): base64 декодируется,
+        но результат не запоминается — blob остается недекодированным.
+        """
+        if blob.state in ('b64', 'xml'):
+            return self.decode(blob)
+        return self.content(blob)
+
+    def read_disk(self, start, end):
+        if self.disk_map is None or len(self.disk_map) < end:          # файл вырос — отображаем заново
+            self.disk_file.flush()
+            self.disk_map = mmap.mmap(self.disk_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.disk_map[start:end]
+
+    def base64(self, blob):
+        """
+        Содержимое blob в base64 (str); еще не декодированное из XML не декодируется.
+        """
+        if blob.state == 'b64':
+            return blob.data.decode('ascii')
+        return base64.b64encode(self.content(blob)).decode('ascii')
+
+
+blob_store = BlobStore()
+
+
+def compact_children(folder):
+    """
+    Переводит детей папки в SortedChildren, если их не меньше порога --compact-dirs.
+    """
+    threshold = params.get('compact_dirs')
+    if threshold and isinstance(folder._children, dict) and len(folder._children) >= threshold:
+        folder._children = SortedChildren(folder._children.items())
+
+
+load_phases = {}                                                        # этап последней загрузки VFS -> время в секундах
+PHASE_NAMES = {                                                         # подписи этапов в stats
+    'snapshot_read': 'чтение снимка',
+    'parse': 'разбор XML и построение дерева',                         # потоковый разбор строит дерево на ходу — этапы не разделить
+    'index': 'индекс папок (ленивый режим)',
+    'snapshot_write': 'запись снимка',
+    'journal': 'проигрывание журнала',
+}
+
+
+def timed_phase(name, func, *args):
+    """
+    Вызывает func(*args) и добавляет время вызова к этапу name в load_phases.
+    """
+    started = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        load_phases[name] = load_phases.get(name, 0.0) + time.perf_counter() - started
+
+
+def load_vfs():
+    """
+    Загружает VFS из XML-файла в память.
+    XML читается потоково (expat), в памяти держится только структура дерева:
+    для содержимого файла запоминается диапазон его base64 в отображенном в память XML,
+    декодируется оно при первом обращении (см. get_content).
+    Если рядом лежит актуальный бинарный снимок (см. save_snapshot), дерево читается из него.
+    С параметром --journal поверх загруженного дерева проигрывается журнал изменений (см. replay_journal).
+    Возвращает верхний узел FolderNode, в котором под именем root лежит корневая папка.
+    """
+    xml_path = params["vfs_path"]
+    if not xml_path or not os.path.exists(xml_path):                    # если не указан путь или файл не существует
+        print(f"Ошибка: файл VFS не найден: {xml_path}")                # выводим ошибку
+        return None
+
+    use_cache = params.get('cache', True)
+    blob_store.reset(params.get('blob_dir'))                            # содержимое прежнего дерева больше не нужно
+    load_phases.clear()
+    try:
+        root_folder = timed_phase('snapshot_read', load_snapshot, xml_path) if use_cache else None  # свежий снимок читается без разбора XML
+        if root_folder is None and params.get('lazy'):                  # ленивый режим: только индекс папок, без разбора
+            root_folder = timed_phase('index', open_lazy_vfs, xml_path)
+        elif root_folder is None:
+            root_folder = timed_phase('parse', stream_vfs, xml_path)    # потоково разбираем XML-файл
+            if use_cache and root_folder is not None:
+                timed_phase('snapshot_write', save_snapshot, xml_path, root_folder)  # при следующем запуске XML разбирать не придется
+    except ET.ParseError as e:                                          # если XML некорректный
+        print(f"Ошибка: неверный формат XML VFS: {e}")                  # выводим ошибку
+        return None
+
+    if root_folder is None:                                             # в <filesystem> нет ни одного элемента
+        print("Ошибка: неверный формат XML VFS: нет корневой папки")
+        return None
+
+    vfs = FolderNode()                                                  # корневая папка лежит в верхнем узле под именем root
+    vfs._children['root'] = root_folder
+    root_folder.name, root_folder.parent = 'root', vfs
+    sum_totals(vfs)
+    path_cache.clear()                                                  # пути из прежнего дерева больше не действительны
+    cow['epoch'] = 0                                                    # версий дерева пока нет
+    cow['frames'] = []
+    reset_node_index()                                                  # индексы имен и владельцев строятся заново по запросу
+
+    if params.get('journal'):                                           # изменения прошлых сессий лежат в журнале
+        params['vfs'] = vfs                                             # replay_journal разрешает пути в этом дереве
+        timed_phase('journal', replay_journal, xml_path)
+    return vfs                                                          # возвращаем vfs
+
+
+def stream_vfs(xml_path):
+    """
+    Потоковый разбор XML VFS через xml.parsers.expat.
+    Корневой папкой считается первый дочерний элемент <filesystem>.
+    Владелец берется из атрибута owner (по умолчанию root).
+    Для файла запоминается только диапазон байт его base64 в XML (как в mount_folder):
+    XML отображается в память, и содержимое читается оттуда при первом обращении.
+    Текст с CDATA, комментариями или сущностями хранится уже разобранным base64.
+    Возвращает корневую папку (FolderNode) или None, если ее нет.
+    """
+    with open(xml_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = False                                      # иначе CurrentByteIndex у текста указывает не на его начало
+        state = {'root': None, 'file': None}
+        stack = []                                                      # открытые элементы: папка или None
+
+        def start(tag, attrs):
+            current = state['file']
+            if current is not None:                                     # элемент внутри <file> — текстом считается только начало
+                current[4] = current[7] = True                          # текст после вложенного элемента к .text не относится
+                current[5] += 1
+                return
+            parent = stack[-1] if stack else None                       # папка-родитель (None, если родитель не папка)
+            node = None
+            if len(stack) == 1 and state['root'] is None:               # первый элемент внутри <filesystem> — корень vfs
+                node = state['root'] = FolderNode(attrs.get('owner', 'root'))
+            elif parent is not None and tag == 'folder':                # вложенная папка
+                name = attrs.get('name')
+                node = FolderNode(attrs.get('owner', 'root'), name=name, parent=parent)
+                parent._children[name] = node
+            elif parent is not None and tag == 'file':                  # [папка, имя, владелец, начало текста, не чистый, глубина, текст, был ребенок]
+                state['file'] = [parent, attrs.get('name'), attrs.get('owner', 'root'), None, False, 0, [], False]
+                return
+            stack.append(node)
+
+        def text(chunk):
+            current = state['file']
+            if current is None or current[7]:
+                return
+            if current[3] is None:
+                current[3] = parser.CurrentByteIndex
+            current[6].append(chunk)
+
+        def markup(*_):                                                 # CDATA или комментарий — диапазон не совпадет с текстом
+            if state['file'] is not None:
+                state['file'][4] = True
+
+        def end(tag):
+            current = state['file']
+            if current is not None:
+                if current[5]:
+                    current[5] -= 1
+                    return
+                parent, name, owner, text_start, mixed, _, parts, _ = current
+                state['file'] = None
+                encoded = ''.join(parts).encode('utf-8')
+                text_end = parser.CurrentByteIndex
+                if text_start is None:                                  # пустой файл
+                    blob = blob_store.intern_base64(b'')
+                elif not mixed and text_end - text_start == len(encoded):   # чистый base64 — в памяти только диапазон
+                    blob = blob_store.intern_base64(encoded, (text_start, text_end))
+                else:
+                    blob = blob_store.intern_base64(encoded)
+                parent._children[name] = FileNode(owner, blob, name, parent)
+                return
+            node = stack.pop()
+            if node is not None:                                        # папка закрыта — дети известны полностью
+                sum_totals(node)
+                compact_children(node)
+
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = text
+        parser.StartCdataSectionHandler = markup
+        parser.CommentHandler = markup
+        try:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                parser.Parse(chunk, False)
+            parser.Parse(b'', True)
+        except xml.parsers.expat.ExpatError as e:
+            raise ET.ParseError(str(e))
+
+    vfs_source['kind'] = 'xml'
+    vfs_source['data'] = data
+    vfs_source['index'] = {}
+    return state['root']
+
+
+def get_content(file_node):
+    """
+    Возвращает содержимое файла VFS в виде байтовой строки.
+    base64 декодируется при первом обращении к содержимому (одному на все одинаковые файлы).
+    В ленивом режиме base64 до этого лежит в исходном XML, после загрузки из снимка — готовые байты в снимке.
+    """
+    return blob_store.content(file_node.blob)
+
+
+# ---------------------------------------------------------------------------
+# Бинарный снимок загруженного дерева: <vfs>.snap рядом с XML (или в --cache-dir).
+# Формат: заголовок, путь к XML, таблица владельцев, имена, записи узлов фиксированного
+# размера в порядке обхода в глубину, таблица blob (ключ, смещение, длина) и в конце —
+# содержимое, каждое уникальное один раз. Метаданные читаются без обращения к содержимому,
+# blob ссылаются на диапазоны байт в отображенном снимке.
+# ---------------------------------------------------------------------------
+
+SNAPSHOT_MAGIC = b'VFSSNAP2'
+SNAPSHOT_HEADER = struct.Struct('<8sQQ32sQQQQQQ')                      # magic, размер XML, mtime_ns XML, хеш XML, длины секций: путь, владельцы, имена, число узлов, число blob, содержимое
+SNAPSHOT_NODE = struct.Struct('<BxxxIIIQQ')                             # тип (0 — папка, 1 — файл), владелец, смещение и длина имени, число детей или номер blob
+SNAPSHOT_BLOB = struct.Struct('<16sQQ')                                 # ключ blob, смещение и длина содержимого
+SNAPSHOT_MTIME_OFFSET = 16                                              # позиция mtime_ns в заголовке
+
+
+def snapshot_path(xml_path):
+    """
+    Путь к файлу снимка для XML: рядом с ним или в каталоге --cache-dir.
+    """
+    cache_dir = params.get('cache_dir')
+    if not cache_dir:
+        return xml_path + '.snap'
+    key = hashlib.sha1(xml_path.encode('utf-8')).hexdigest()[:16]       # разные XML с одинаковым именем не пересекаются
+    return os.path.join(cache_dir, f"{key}-{os.path.basename(xml_path)}.snap")
+
+
+def xml_digest(xml_path):
+    """
+    Хеш blake2b содержимого XML-файла.
+    """
+    digest = hashlib.blake2b(digest_size=32)
+    with open(xml_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def save_snapshot(xml_path, root_folder):
+    """
+    Сохраняет дерево в бинарный снимок; одинаковое содержимое пишется один раз.
+    Содержимое декодируется по одному blob и сразу пишется в файл: в памяти оно не остается,
+    и blob дерева остаются недекодированными (см. BlobStore.peek).
+    Пишется во временный файл и атомарно переименовывается. Если записать снимок нельзя,
+    выводится предупреждение, а оболочка работает без кэша.
+    """
+    owners = {}                                                         # владелец -> номер в таблице
+    names = bytearray()
+    records = []
+    blobs = {}                                                          # Blob -> номер в таблице blob
+    order = []                                                          # уникальные blob в порядке таблицы
+
+    stack = [('root', root_folder)]
+    while stack:
+        name, node = stack.pop()
+        owner = owners.setdefault(node.owner, len(owners))
+        encoded = name.encode('utf-8')
+        if isinstance(node, FolderNode):
+            children = list(node.children.items())
+            records.append(SNAPSHOT_NODE.pack(0, owner, len(names), len(encoded), len(children), 0))
+            stack.extend(reversed(children))                            # дети в исходном порядке
+        else:
+            number = blobs.get(node.blob)
+            if number is None:
+                number = blobs[node.blob] = len(order)
+                order.append(node.blob)
+            records.append(SNAPSHOT_NODE.pack(1, owner, len(names), len(encoded), number, 0))
+        names += encoded
+
+    stat = os.stat(xml_path)
+    path_bytes = xml_path.encode('utf-8')
+    owner_bytes = '\0'.join(owners).encode('utf-8')
+    target = snapshot_path(xml_path)
+    temp = f"{target}.{os.getpid()}.tmp"
+    digest = xml_digest(xml_path)
+
+    def header(data_len):
+        return SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, stat.st_size, stat.st_mtime_ns, digest,
+                                    len(path_bytes), len(owner_bytes), len(names), len(records), len(order), data_len)
+
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(temp, 'wb') as f:
+            f.write(header(0))
+            f.write(path_bytes)
+            f.write(owner_bytes)
+            f.write(names)
+            f.write(b''.join(records))
+            table_start = f.tell()
+            f.seek(len(order) * SNAPSHOT_BLOB.size, os.SEEK_CUR)        # таблица blob пишется после содержимого: длины станут известны
+            blob_records = []
+            data_len = 0
+            for blob in order:
+                content = blob_store.peek(blob)
+                blob_records.append(SNAPSHOT_BLOB.pack(blob.key, data_len, len(content)))
+                f.write(content)
+                data_len += len(content)
+            f.seek(table_start)
+            f.write(b''.join(blob_records))
+            f.seek(0)
+            f.write(header(data_len))
+        os.replace(temp, target)
+    except OSError as e:                                                # нет прав или места — работаем без кэша
+        print(f"Предупреждение: снимок VFS не сохранен ({target}): {e.strerror}")
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+
+
+def load_snapshot(xml_path):
+    """
+    Читает дерево из снимка, если он соответствует XML (путь, размер, mtime, а при
+    несовпадении mtime — хеш содержимого). Возвращает корневую папку или None, если снимок устарел.
+    """
+    try:
+        with open(snapshot_path(xml_path), 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):                                       # снимка нет или он пустой
+        return None
+
+    try:
+        (magic, size, mtime_ns, digest, path_len, owners_len, names_len,
+         node_count, blob_count, data_len) = SNAPSHOT_HEADER.unpack_from(data, 0)
+    except struct.error:
+        return None
+    pos = SNAPSHOT_HEADER.size
+    nodes_start = pos + path_len + owners_len + names_len
+    blobs_start = nodes_start + node_count * SNAPSHOT_NODE.size
+    data_start = blobs_start + blob_count * SNAPSHOT_BLOB.size
+    if (magic != SNAPSHOT_MAGIC or data_start + data_len != len(data)
+            or data[pos:pos + path_len] != xml_path.encode('utf-8')):
+        return None
+
+    stat = os.stat(xml_path)
+    if size != stat.st_size:
+        return None
+    if mtime_ns != stat.st_mtime_ns:                                    # файл трогали — сверяем содержимое
+        if digest != xml_digest(xml_path):
+            return None
+        try:                                                            # содержимое то же — запоминаем новый mtime
+            with open(snapshot_path(xml_path), 'r+b') as f:
+                f.seek(SNAPSHOT_MTIME_OFFSET)
+                f.write(struct.pack('<Q', stat.st_mtime_ns))
+        except OSError:
+            pass
+
+    pos += path_len
+    owners = [sys.intern(owner) for owner in data[pos:pos + owners_len].decode('utf-8').split('\0')]
+    pos += owners_len
+    names = data[pos:pos + names_len]
+    blobs = [blob_store.add(key, length, 'snapshot', (data_start + offset, data_start + offset + length))
+             for key, offset, length in SNAPSHOT_BLOB.iter_unpack(memoryview(data)[blobs_start:data_start])]
+
+    records = SNAPSHOT_NODE.iter_unpack(memoryview(data)[nodes_start:blobs_start])
+    kind, owner, _, _, count, _ = next(records)
+    root_folder = FolderNode(owners[owner])
+    stack = [[root_folder, count]]                                      # открытые папки и сколько детей осталось прочитать
+    for kind, owner, name_start, name_len, first, second in records:
+        while stack[-1][1] == 0:
+            closed = stack.pop()[0]
+            sum_totals(closed)
+            compact_children(closed)
+        entry = stack[-1]
+        entry[1] -= 1
+        name = names[name_start:name_start + name_len].decode('utf-8')
+        if kind == 0:
+            node = FolderNode(owners[owner], name=name, parent=entry[0])
+            stack.append([node, first])
+        else:
+            node = FileNode(owners[owner], blobs[first], name, entry[0])
+            blob_store.retain(node.blob)                                 # ссылки на blob учитываются по файлам
+        entry[0]._children[name] = node
+    for folder, _ in reversed(stack):
+        sum_totals(folder)
+        compact_children(folder)
+
+    vfs_source['kind'] = 'snapshot'
+    vfs_source['data'] = data
+    vfs_source['index'] = None
+    return root_folder
+
+
+# ---------------------------------------------------------------------------
+# Ленивое монтирование: XML отображается в память (mmap), один раз сканируется
+# регулярным выражением и для каждой <folder> запоминается диапазон байт.
+# Папка разбирается только тогда, когда get_folder впервые до нее доходит.
+# ---------------------------------------------------------------------------
+
+vfs_source = {'kind': None, 'data': None, 'index': None}               # откуда читаются диапазоны: 'xml' или 'snapshot', mmap и индекс папок
+
+XML_TOKEN = re.compile(                                                 # один токен разметки: комментарий, CDATA, служебный тег или тег элемента
+    rb'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<\?.*?\?>|<![^>]*>'
+    rb'|<(/?)([A-Za-z_][\w.:-]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*?)(/?)>',
+    re.S)
+XML_ATTR = re.compile(rb'([\w.:-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')    # атрибут name="..." в теге
+XML_CHAR_REF = re.compile(r'&#(x[0-9A-Fa-f]+|[0-9]+);')                # числовые ссылки на символы
+INDEX_MAGIC = b'VFSIDX1\0'
+INDEX_HEADER = struct.Struct('<8sQQQQ')                                 # magic, размер XML, mtime_ns XML, начало корня, число папок
+
+
+def xml_unescape(raw):
+    """
+    Декодирует байты из XML в строку и раскрывает сущности (&amp; и т.п. и &#NN;).
+    """
+    text = raw.decode('utf-8')
+    if '&' not in text:
+        return text
+    text = XML_CHAR_REF.sub(lambda m: chr(int('0' + m.group(1), 0) if m.group(1)[0] == 'x' else int(m.group(1))), text)
+    return unescape(text, {'&quot;': '"', '&apos;': "'"})
+
+
+def xml_text(raw):
+    """
+    Текст элемента по его внутренним байтам: до первого дочернего элемента, без комментариев,
+    с раскрытием CDATA и сущностей (так же, как element.text у ElementTree).
+    """
+    if b'<' not in raw:                                                 # обычный случай: только base64
+        return xml_unescape(raw)
+    parts = []
+    pos = 0
+    for m in XML_TOKEN.finditer(raw):
+        parts.append(xml_unescape(raw[pos:m.start()]))
+        token = m.group(0)
+        if token.startswith(b'<![CDATA['):
+            parts.append(token[9:-3].decode('utf-8'))
+        elif m.group(2) is not None:                                    # дочерний элемент — дальше текст уже не element.text
+            return ''.join(parts)
+        pos = m.end()
+    parts.append(xml_unescape(raw[pos:]))
+    return ''.join(parts)
+
+
+def tag_attrs(attrs):
+    """
+    Словарь атрибутов тега по байтам его атрибутов.
+    """
+    return {m.group(1).decode('utf-8'): xml_unescape(m.group(2) if m.group(2) is not None else m.group(3))
+            for m in XML_ATTR.finditer(attrs)}
+
+
+def scan_folder_index(data):
+    """
+    Один проход по всему XML: для каждой <folder> запоминается пара (начало, конец) в байтах.
+    Возвращает (смещение корневой папки, словарь {начало: конец}).
+    Проверяется только баланс тегов, полной валидации XML здесь нет.
+    """
+    index = {}
+    stack = []                                                          # открытые элементы: (имя тега, начало)
+    root_start = None
+
+    for m in XML_TOKEN.finditer(data):
+        tag = m.group(2)
+        if tag is None:                                                 # комментарий, CDATA, <?...?>, <!DOCTYPE>
+            continue
+        if m.group(1):                                                  # закрывающий тег
+            if not stack or stack[-1][0] != tag:
+                raise ET.ParseError(f"несогласованный тег </{tag.decode('utf-8', 'replace')}> (байт {m.start()})")
+            _, start = stack.pop()
+            if tag == b'folder':
+                index[start] = m.end()
+            continue
+        if len(stack) == 1 and root_start is None:                      # первый элемент внутри <filesystem>
+            root_start = m.start()
+        if m.group(4):                                                  # самозакрывающийся тег
+            if tag == b'folder':
+                index[m.start()] = m.end()
+            continue
+        stack.append((tag, m.start()))
+
+    if stack:
+        raise ET.ParseError(f"незакрытый тег <{stack[-1][0].decode('utf-8', 'replace')}>")
+    return root_start, index
+
+
+def load_folder_index(xml_path, data):
+    """
+    Возвращает индекс папок для XML: читает файл-спутник <xml>.idx, если он соответствует
+    размеру и времени изменения XML, иначе сканирует XML и пытается сохранить спутник.
+    """
+    stat = os.stat(xml_path)
+    index_path = xml_path + '.idx'
+
+    try:
+        with open(index_path, 'rb') as f:
+            magic, size, mtime_ns, root_start, count = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+            if magic == INDEX_MAGIC and size == stat.st_size and mtime_ns == stat.st_mtime_ns:
+                offsets = array('Q')
+                offsets.fromfile(f, 2 * count)
+                return root_start, dict(zip(offsets[0::2], offsets[1::2]))
+    except (OSError, EOFError, struct.error):                           # спутника нет, он битый или короче ожидаемого
+        pass
+
+    root_start, index = scan_folder_index(data)
+    if root_start is None:
+        return None, index
+
+    try:
+        with open(index_path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, root_start, len(index)))
+            offsets = array('Q')
+            for start, end in index.items():
+                offsets.append(start)
+                offsets.append(end)
+            offsets.tofile(f)
+    except OSError:                                                     # нет прав на запись рядом с XML — работаем без спутника
+        pass
+    return root_start, index
+
+
+def open_lazy_vfs(xml_path):
+    """
+    Открывает VFS в ленивом режиме: отображает XML в память, строит (или читает) индекс папок
+    и возвращает незамонтированную корневую папку. Возвращает None, если корня нет.
+    """
+    with open(xml_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ET.ParseError("пустой файл")
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    root_start, index = load_folder_index(xml_path, data)
+    if root_start is None:
+        return None
+
+    vfs_source['kind'] = 'xml'
+    vfs_source['data'] = data
+    vfs_source['index'] = index
+    attrs = tag_attrs(XML_TOKEN.match(data, root_start).group(3))
+    return FolderNode(attrs.get('owner', 'root'), span=root_start)
+
+
+def skip_element(data, m):
+    """
+    Возвращает смещение конца элемента, начинающегося токеном m (для элементов вне индекса).
+    """
+    if m.group(4):                                                      # самозакрывающийся
+        return m.end()
+    depth = 1
+    for token in XML_TOKEN.finditer(data, m.end()):
+        if token.group(2) is None or token.group(4):
+            continue
+        depth += -1 if token.group(1) else 1
+        if depth == 0:
+            return token.end()
+    return len(data)
+
+
+def mount_folder(folder):
+    """
+    Монтирует ленивую папку: разбирает только ее непосредственных детей.
+    Вложенные папки становятся такими же ленивыми заглушками, файлы хранят диапазон своего base64.
+    """
+    data = vfs_source['data']
+    index = vfs_source['index']
+    start = folder.span
+    end = index[start]
+    folder.span = None
+    children = folder._children
+
+    opening = XML_TOKEN.match(data, start)
+    if opening.group(4):                                                # <folder .../> — пустая папка
+        return
+
+    pos = opening.end()
+    while True:
+        m = XML_TOKEN.search(data, pos, end)
+        if m is None or m.group(1):                                     # дошли до </folder>
+            compact_children(folder)
+            return
+        tag = m.group(2)
+        if tag == b'folder':                                            # вложенная папка — границы берем из индекса
+            attrs = tag_attrs(m.group(3))
+            name = attrs.get('name')
+            children[name] = FolderNode(attrs.get('owner', 'root'), m.start(), name, folder, epoch=folder.epoch)
+            pos = index[m.start()]
+        elif tag == b'file':
+            attrs = tag_attrs(m.group(3))
+            name = attrs.get('name')
+            element_end = skip_element(data, m)
+            if m.group(4):
+                blob = blob_store.intern_base64(b'')
+            else:
+                payload = (m.end(), data.rfind(b'</', m.end(), element_end))
+                text = data[payload[0]:payload[1]]
+                if b'<' in text or b'&' in text:                         # CDATA или сущности — храним уже разобранный base64
+                    blob = blob_store.intern_base64(xml_text(text).encode('utf-8'))
+                else:                                                   # чистый base64 — в памяти только диапазон
+                    blob = blob_store.intern_base64(text, payload)
+            children[name] = FileNode(attrs.get('owner', 'root'), blob, name, folder, folder.epoch)  # дети общей папки тоже общие
+            pos = element_end
+        elif tag is not None:                                           # посторонний элемент — пропускаем целиком
+            pos = skip_element(data, m)
+        else:                                                           # комментарий и т.п.
+            pos = m.end()
+
+
+def mount_all(folder=None):
+    """
+    Принудительно монтирует все поддерево (по умолчанию всю VFS).
+    Нужна командам, которым надо видеть дерево целиком (find, du, индексы, команда mount, --mount-all).
+    Возвращает, сколько папок было смонтировано.
+    """
+    mounted = 0
+    stack = [params['vfs'] if folder is None else folder]
+    while stack:
+        current = stack.pop()
+        if current.span is not None:
+            mounted += 1
+        for child in current.children.values():                         # обращение к children монтирует папку
+            if isinstance(child, FolderNode):
+                stack.append(child)
+    return mounted
+
+
+@command('mount', max_args=1, usage='mount: использование: mount [путь]')
+def handle_mount(args):
+    """
+    mount [путь] — в ленивом режиме (--lazy) монтирует все поддерево папки (по умолчанию всю VFS):
+    дальше команды не разбирают XML по ходу работы
+    """
+    if params['vfs'] is None:
+        print('Ошибка: VFS не загружен')
+        return False
+
+    path_str = args[1] if len(args) > 1 else '/'
+    folder = get_folder(normalize_path(path_str))
+    if folder is None:
+        print(f"mount: {path_str}: папка не найдена")
+        return False
+    print(f"Смонтировано папок: {mount_all(folder)}")
+
+
+# ---------------------------------------------------------------------------
+# Разрешение путей. Все команды переводят строку пути в список имен от корня
+# (normalize_path), а узел по списку ищут через resolve, который держит
+# ограниченный LRU-кэш разрешенных путей. mv сбрасывает из кэша только пути,
+# начинающиеся с перемещенного или перезаписанного пути (invalidate_paths).
+# ---------------------------------------------------------------------------
+
+HOME_PATH = ('root', 'home', 'user')                                    # домашняя папка, на которую указывает ~
+PATH_CACHE_SIZE = 4096                                                  # сколько разрешенных путей держать в кэше
+path_cache = OrderedDict()                                              # кортеж имен от корня -> узел
+
+
+def normalize_path(path_str, cwd=None):
+    """
+    Переводит строку пути в список имен от корня, вида ['root', 'home', 'user'].
+    Поддерживаются абсолютные пути (/...), пути от домашней папки (~, ~/...) и относительные
+    пути от cwd (по умолчанию текущая рабочая папка), внутри любых из них — '.' и '..'.
+    '..' в корне оставляет корень.
+    """
+    if path_str.startswith('/'):                                        # абсолютный путь от корня
+        parts = ['root']
+    elif path_str == '~' or path_str.startswith('~/'):                  # путь от домашней папки
+        parts = list(HOME_PATH)
+        path_str = path_str[1:]
+    else:                                                               # относительный путь
+        parts = list(params['current_working_directory'] if cwd is None else cwd)
+
+    for name in path_str.split('/'):
+        if not name or name == '.':                                     # пустые части (//) и текущая папка
+            continue
+        if name == '..':                                                # подняться на уровень выше, но не выше корня
+            if len(parts) > 1:
+                parts.pop()
+            continue
+        parts.append(name)
+    return parts
+
+
+def resolve(path):
+    """
+    Возвращает узел (FolderNode или FileNode) по списку имен от корня или None, если его нет.
+    Разрешенные пути и все их префиксы кладутся в кэш, поэтому повторные обращения
+    к тем же и соседним путям не проходят дерево от корня.
+    """
+    key = tuple(path)
+    node = path_cache.get(key)
+    if node is not None:                                                # путь уже разрешали
+        path_cache.move_to_end(key)
+        counters['path_hits'] += 1
+        return node
+
+    missing = []                                                        # имена после самого длинного закэшированного префикса
+    while key and key not in path_cache:
+        missing.append(key[-1])
+        key = key[:-1]
+    counters['path_walks'] += 1
+    counters['path_steps'] += len(missing)
+    node = path_cache[key] if key else params['vfs']
+
+    for name in reversed(missing):
+        if not isinstance(node, FolderNode):                            # путь продолжается внутрь файла
+            return None
+        node = node.children.get(name)                                  # ленивая папка монтируется при обращении
+        if node is None:
+            return None
+        key += (name,)
+        path_cache[key] = node
+        if len(path_cache) > PATH_CACHE_SIZE:                           # выталкиваем самый давно использованный путь
+            path_cache.popitem(last=False)
+    if key:                                                             # пустой путь (верхний узел) в кэш не кладется
+        path_cache.move_to_end(key)
+    return node
+
+
+def invalidate_paths(*paths):
+    """
+    Удаляет из кэша путей все записи, начинающиеся с любого из переданных путей.
+    """
+    prefixes = [tuple(path) for path in paths]
+    stale = [key for key in path_cache
+             if any(key[:len(prefix)] == prefix for prefix in prefixes)]
+    for key in stale:
+        del path_cache[key]
+
+
+def get_folder(path):
+    """
+    Возвращает папку (FolderNode) внутри VFS по списку path.
+    path — список папок от корня, вида *['root', 'home', 'user']
+    """
+    out_folder = resolve(path)                                          # ищем узел через кэш путей
+    if not isinstance(out_folder, FolderNode):                          # если папки нет или это файл
+        return None
+    return out_folder                                                   # возвращаем искомую папку
+
+
+def invalidate_children(parts, names):
+    """
+    Удаляет из кэша путей записи под детьми names папки parts — за один проход по кэшу
+    на любое число имен (invalidate_paths проверял бы каждый префикс отдельно).
+    """
+    prefix = tuple(parts)
+    depth = len(prefix)
+    names = set(names)
+    stale = [key for key in path_cache
+             if len(key) > depth and key[depth] in names and key[:depth] == prefix]
+    for key in stale:
+        del path_cache[key]
+
+
+# ---------------------------------------------------------------------------
+# Упорядоченные имена детей и шаблоны имен. У папки в SortedChildren имена уже
+# отсортированы, у обычной папки отсортированный список строится при первом
+# запросе (ls, шаблон) и дальше поддерживается вставкой и удалением (bisect).
+# ---------------------------------------------------------------------------
+
+GLOB_CHARS = re.compile(r'[*?\[]')                                      # спецсимволы шаблонов fnmatch
+
+
+def sorted_names(folder):
+    """
+    Имена детей папки по возрастанию. Список общий с папкой — менять его нельзя.
+    """
+    children = folder.children
+    if isinstance(children, SortedChildren):
+        return children.names
+    if folder.order is None:
+        folder.order = sorted(children)
+    return folder.order
+
+
+def attach_child(folder, name, node):
+    """
+    Кладет узел в папку под именем name (заменяя прежний), поддерживая отсортированный список имен.
+    """
+    children = folder.children
+    if folder.order is not None and name not in children:
+        bisect.insort(folder.order, name)
+    children[name] = node
+
+
+def detach_child(folder, name):
+    """
+    Убирает ребенка name из папки, поддерживая отсортированный список имен. Возвращает узел.
+    """
+    node = folder.children.pop(name)
+    if folder.order is not None:
+        del folder.order[bisect.bisect_left(folder.order, name)]
+    return node
+
+
+def is_glob(name):
+    return GLOB_CHARS.search(name) is not None
+
+
+def iter_matches(folder, pattern):
+    """
+    Имена детей папки, подходящие под шаблон fnmatch (с учетом регистра), по возрастанию.
+    Часть шаблона до первого спецсимвола ищется бинарным поиском, дальше перебираются
+    только имена с этим началом.
+    """
+    names = sorted_names(folder)
+    prefix = pattern[:GLOB_CHARS.search(pattern).start()] if is_glob(pattern) else pattern
+    match = re.compile(fnmatch.translate(pattern)).match
+    for i in range(bisect.bisect_left(names, prefix), len(names)):
+        name = names[i]
+        if not name.startswith(prefix):
+            break
+        if match(name):
+            yield name
+
+
+def split_glob(path_str):
+    """
+    Делит путь с шаблоном в последнем имени на (путь к папке, шаблон); для пути без шаблона — None.
+    """
+    head, _, pattern = path_str.rpartition('/')
+    if not is_glob(pattern) or is_glob(head):
+        return None
+    if not head and path_str.startswith('/'):
+        head = '/'
+    return head or '.', pattern
+
+
+# ---------------------------------------------------------------------------
+# Вторичные индексы: имя -> узлы и владелец -> узлы. Строятся одним обходом при
+# первом запросе (ensure_node_index, в ленивом режиме — с полным монтированием),
+# дальше поддерживаются изменениями дерева (move_node, make_folder, set_owner).
+# Значение индекса — сам узел, если он один, иначе множество узлов: уникальных
+# имен в больших образах много, и отдельное множество на каждое было бы дорого.
+# ---------------------------------------------------------------------------
+
+node_index = {'built': False, 'name': {}, 'owner': {}}
+
+
+def reset_node_index():
+    """
+    Сбрасывает индексы (новое дерево): они построятся заново при первом запросе.
+    """
+    node_index['built'] = False
+    node_index['name'] = {}
+    node_index['owner'] = {}
+
+
+def index_add(index, key, node):
+    current = index.get(key)
+    if current is None:
+        index[key] = node
+    elif isinstance(current, set):
+        current.add(node)
+    elif current is not node:
+        index[key] = {current, node}
+
+
+def index_remove(index, key, node):
+    current = index.get(key)
+    if isinstance(current, set):
+        current.discard(node)
+        if len(current) == 1:
+            index[key] = current.pop()
+    elif current is node:
+        del index[key]
+
+
+def index_lookup(index, key):
+    """
+    Узлы индекса по ключу (кортеж, возможно пустой).
+    """
+    current = index.get(key)
+    if current is None:
+        return ()
+    if isinstance(current, set):
+        return tuple(current)
+    return (current,)
+
+
+def index_subtree(node, action):
+    """
+    Добавляет (action=index_add) или удаляет (index_remove) из индексов узел и все его поддерево.
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        action(node_index['name'], node.name, node)
+        action(node_index['owner'], node.owner, node)
+        if isinstance(node, FolderNode):
+            stack.extend(node.children.values())
+
+
+def ensure_node_index():
+    """
+    Строит индексы имен и владельцев, если они еще не построены.
+    Заодно восстанавливает name и parent узлов: после отката версии (rollback_to)
+    они могут указывать в отброшенную версию дерева.
+    """
+    if node_index['built']:
+        return
+    if params.get('lazy'):                                              # индексам нужно все дерево
+        mount_all()
+    stack = [params['vfs']]
+    while stack:
+        folder = stack.pop()
+        for name, node in folder.children.items():
+            node.name, node.parent = name, folder
+            index_add(node_index['name'], name, node)
+            index_add(node_index['owner'], node.owner, node)
+            if isinstance(node, FolderNode):
+                stack.append(node)
+    node_index['built'] = True
+
+
+def node_path(node):
+    """
+    Путь узла в виде списка имен от корня, вида ['root', 'home', 'user'].
+    """
+    parts = []
+    while node.parent is not None:
+        parts.append(node.name)
+        node = node.parent
+    parts.reverse()
+    return parts
+
+
+def format_path(parts):
+    """
+    Строка пути для вывода: '/' для корня, иначе /<папки через '/'>.
+    """
+    return '/' + '/'.join(parts[1:])
+
+
+def owned_children(folder, owner):
+    """
+    Пары (имя, узел) детей папки с данным владельцем, по возрастанию имен. Если у владельца
+    меньше узлов, чем детей в папке, они берутся из индекса владельцев, иначе перебираются дети.
+    """
+    if indexing():
+        owned = node_index['owner'].get(owner)
+        size = 0 if owned is None else len(owned) if isinstance(owned, set) else 1
+        if size < len(folder.children):
+            nodes = [node for node in index_lookup(node_index['owner'], owner) if node.parent is folder]
+            nodes.sort(key=lambda node: node.name)                      # в порядке ls без --owner
+            return [(node.name, node) for node in nodes]
+    children = folder.children
+    return [(name, children[name]) for name in sorted_names(folder) if children[name].owner == owner]
+
+
+def is_inside(node, folder):
+    """
+    True, если узел лежит в поддереве папки folder (или совпадает с ней).
+    """
+    while node is not None:
+        if node is folder:
+            return True
+        node = node.parent
+    return False
+
+
+@command('find', usage='find: использование: find [путь] [-name <шаблон>] [-user <владелец>]')
+def handle_find(args):
+    """
+    find [путь] [-name <шаблон>] [-user <владелец>] — ищет объекты в поддереве пути (по умолчанию текущая папка).
+    Кандидаты берутся из индексов имен и владельцев, а не обходом дерева;
+    шаблон имени может содержать *, ? и [...].
+    """
+    if params['vfs'] is None:
+        print('Ошибка: VFS не загружен')
+        return
+
+    path_str = None
+    name_pattern = None
+    owner = None
+    rest = args[1:]
+    while rest:
+        if rest[0] in ('-name', '-user') and len(rest) > 1:
+            if rest[0] == '-name':
+                name_pattern = rest[1]
+            else:
+                owner = rest[1]
+            rest = rest[2:]
+        elif path_str is None and not rest[0].startswith('-'):
+            path_str = rest[0]
+            rest = rest[1:]
+        else:
+            print(COMMANDS['find'].usage)
+            return
+
+    top = resolve(normalize_path(path_str or '.'))
+    if top is None:
+        print(f"find: {path_str}: объект не найден")
+        return
+    match = re.compile(fnmatch.translate(name_pattern)).match if name_pattern is not None else None  # с учетом регистра, как в ls, mv, chown
+
+    if name_pattern is None and owner is None or cow['private']:        # без условий или в песочнице (там нет индексов) — обход поддерева
+        if params.get('lazy') and isinstance(top, FolderNode):
+            mount_all(top)
+        paths = []
+        stack = [(top, normalize_path(path_str or '.'))]
+        while stack:
+            node, parts = stack.pop()
+            if ((match is None or match(parts[-1]))
+                    and (owner is None or node.owner == owner)):
+                paths.append(format_path(parts))
+            if isinstance(node, FolderNode):
+                stack.extend((child, parts + [name]) for name, child in node.children.items())
+        for path in sorted(paths):
+            print(path)
+        return
+
+    ensure_node_index()
+    if name_pattern is None:
+        matches = index_lookup(node_index['owner'], owner)
+    elif any(char in name_pattern for char in '*?['):                 # шаблон — перебираем имена, а не узлы
+        matches = [node for name in node_index['name'] if match(name)
+                   for node in index_lookup(node_index['name'], name)]
+    else:
+        matches = index_lookup(node_index['name'], name_pattern)
+    if owner is not None and name_pattern is not None:
+        matches = [node for node in matches if node.owner == owner]
+    matches = [node for node in matches if is_inside(node, top)]
+
+    for path in sorted(format_path(node_path(node)) for node in matches):
+        print(path)
+
+
+# ---------------------------------------------------------------------------
+# Агрегаты папок: у каждой папки в totals хранится [байт, файлов, папок] всего
+# ее поддерева (без самой папки). Загрузчики считают их при закрытии папки,
+# изменения дерева поправляют только цепочки предков (adjust_totals), поэтому
+# du -s и размеры в ls -l берутся за O(1). totals = None — еще не посчитано
+# (ленивая папка); тогда неизвестны и агрегаты всех ее предков.
+# ---------------------------------------------------------------------------
+
+def sum_totals(folder):
+    """
+    Считает агрегаты папки по уже известным агрегатам детей (None, если какой-то неизвестен).
+    """
+    total = [0, 0, 0]
+    for child in folder._children.values():
+        contribution = node_totals(child)
+        if contribution is None:
+            folder.totals = None
+            return None
+        total[0] += contribution[0]
+        total[1] += contribution[1]
+        total[2] += contribution[2]
+    folder.totals = total
+    return total
+
+
+def node_totals(node):
+    """
+    Вклад узла в агрегаты его папки: (байт, файлов, папок) с учетом самого узла, None — неизвестен.
+    """
+    if isinstance(node, FileNode):
+        return node.blob.size, 1, 0
+    if node.totals is None:
+        return None
+    size, files, folders = node.totals
+    return size, files, folders + 1
+
+
+def folder_totals(folder):
+    """
+    Агрегаты папки. Если они еще не посчитаны (ленивый режим), поддерево монтируется
+    и считается один раз, дальше результат хранится в папках.
+    """
+    if folder.totals is not None:
+        return folder.totals
+    stack = [(folder, False)]
+    while stack:                                                        # обход в глубину: папка считается после всех детей
+        current, ready = stack.pop()
+        if ready:
+            sum_totals(current)
+            continue
+        stack.append((current, True))
+        stack.extend((child, False) for child in current.children.values()
+                     if isinstance(child, FolderNode) and child.totals is None)
+    return folder.totals
+
+
+def adjust_totals(folder, node, sign):
+    """
+    Добавляет (sign=1) или вычитает (sign=-1) вклад узла node в агрегаты папки folder и всех ее предков.
+    """
+    add_totals(folder, node_totals(node), sign)
+
+
+def nodes_totals(nodes):
+    """
+    Суммарный вклад узлов (байт, файлов, папок) или None, если вклад какого-то из них неизвестен.
+    """
+    total = [0, 0, 0]
+    for node in nodes:
+        contribution = node_totals(node)
+        if contribution is None:
+            return None
+        total[0] += contribution[0]
+        total[1] += contribution[1]
+        total[2] += contribution[2]
+    return total
+
+
+def add_totals(folder, contribution, sign):
+    """
+    Добавляет (sign=1) или вычитает (sign=-1) вклад (байт, файлов, папок) в агрегаты папки folder и всех ее предков.
+    Если вклад неизвестен (None), агрегаты цепочки сбрасываются и будут пересчитаны по запросу.
+    """
+    while folder is not None and folder.totals is not None:
+        if contribution is None:
+            folder.totals = None
+        else:
+            total = folder.totals
+            total[0] += sign * contribution[0]
+            total[1] += sign * contribution[1]
+            total[2] += sign * contribution[2]
+        folder = folder.parent
+
+
+@command('du', max_args=2, usage='du: использование: du [-s] [путь]')
+def handle_du(args):
+    """
+    du [-s] [путь] — размер поддерева в байтах (по умолчанию текущая папка)
+    без -s — для каждой папки поддерева, с -s — только итог, с числом файлов и папок
+    """
+    if params['vfs'] is None:
+        print('Ошибка: VFS не загружен')
+        return
+
+    summary = len(args) > 1 and args[1] == '-s'
+    rest = args[2:] if summary else args[1:]
+    if len(rest) > 1 or rest and rest[0].startswith('-'):
+        print(COMMANDS['du'].usage)
+        return
+
+    path_str = rest[0] if rest else '.'
+    parts = normalize_path(path_str)
+    node = resolve(parts)
+    if node is None:
+        print(f"du: {path_str}: объект не найден")
+        return
+
+    if isinstance(node, FileNode):
+        print(f"{node.blob.size}\t{format_path(parts)}")
+    elif summary:
+        size, files, folders = folder_totals(node)
+        print(f"{size}\t{format_path(parts)} (файлов: {files}, папок: {folders})")
+    else:
+        if params.get('lazy'):                                          # выводятся все папки поддерева
+            mount_all(node)
+        folder_totals(node)
+        lines = []
+        stack = [(node, parts)]
+        while stack:
+            folder, folder_parts = stack.pop()
+            lines.append((folder_parts, folder.totals[0]))
+            stack.extend((child, folder_parts + [name]) for name, child in folder.children.items()
+                         if isinstance(child, FolderNode))
+        for folder_parts, size in sorted(lines, key=lambda line: line[0], reverse=True):  # как у du: вложенные папки раньше родителя
+            print(f"{size}\t{format_path(folder_parts)}")
+
+
+# ---------------------------------------------------------------------------
+# Версии дерева: копирование при записи. Узлы дерева общие для нескольких версий:
+# точек отката (snapshot, undo) и песочниц (sandbox). Каждый узел помнит эпоху,
+# в которую создан. Когда появляется еще одна версия, эпоха увеличивается (freeze),
+# и все существующие узлы становятся замороженными. Изменение копирует только
+# замороженные узлы на пути от корня к изменяемому (writable_folder, thaw_child):
+# O(глубина) по времени и памяти, а не O(дерево). name и parent узлов и индексы
+# ведутся только для основной версии; после отката индексы строятся заново и
+# заодно исправляют name и parent. Песочница — отдельное представление со своим
+# корнем и кэшем путей: она не пишет журнал и не трогает индексы и счетчики blob_store.
+# ---------------------------------------------------------------------------
+
+cow = {'epoch': 0, 'frames': [], 'private': False, 'saved': None}       # эпоха, стек точек отката, песочница ли, основное представление на время песочницы
+
+
+def freeze():
+    """
+    Замораживает все существующие узлы: следующее изменение любого из них его скопирует.
+    """
+    cow['epoch'] += 1
+
+
+def indexing():
+    """
+    True, если изменения дерева должны поддерживать индексы (построены и это не песочница).
+    """
+    return node_index['built'] and not cow['private']
+
+
+def copy_folder(folder, name, parent):
+    """
+    Копия папки текущей эпохи с тем же набором детей (сами дети общие).
+    """
+    children = folder.children                                          # ленивая папка монтируется на месте: ее содержимое одно для всех версий
+    copy = FolderNode(folder.owner, name=name, parent=parent, totals=copy_totals(folder), epoch=cow['epoch'])
+    copy._children = children.copy()
+    if folder.order is not None:
+        copy.order = list(folder.order)
+    if indexing():                                                      # для find путь узлов восстанавливается по parent
+        for child in children.values():
+            child.parent = copy
+    return copy
+
+
+def thaw_child(parent, name):
+    """
+    Ребенок name изменяемой папки parent, который можно менять в текущей версии:
+    сам узел, если он создан в текущей эпохе, иначе его копия, поставленная на его место.
+    """
+    node = parent.children[name]
+    if node.epoch == cow['epoch']:
+        return node
+    if isinstance(node, FileNode):
+        copy = FileNode(node.owner, node.blob, name, parent, cow['epoch'])
+    else:
+        copy = copy_folder(node, name, parent)
+    parent.children[name] = copy
+    if indexing():
+        index_remove(node_index['name'], node.name, node)
+        index_remove(node_index['owner'], node.owner, node)
+        index_add(node_index['name'], name, copy)
+        index_add(node_index['owner'], copy.owner, copy)
+    return copy
+
+
+def writable_folder(parts):
+    """
+    Папка по пути parts, которую можно менять: замороженные папки на пути от корня
+    копируются, кэш путей для них сбрасывается. None, если такой папки нет.
+    """
+    if cow['epoch'] == 0:                                               # версий еще не было — все узлы изменяемые
+        return get_folder(parts)
+    folder = params['vfs']
+    if folder.epoch != cow['epoch']:
+        folder = params['vfs'] = copy_folder(folder, None, None)
+    for depth, name in enumerate(parts):
+        child = folder.children.get(name)
+        if not isinstance(child, FolderNode):
+            return None
+        if child.epoch != cow['epoch']:
+            child = thaw_child(folder, name)
+            path_cache.pop(tuple(parts[:depth + 1]), None)
+        folder = child
+    return folder
+
+
+def retain_blob(blob):
+    """
+    Учитывает новую ссылку на blob (в песочнице счетчики не ведутся). Пока есть точки
+    отката, ссылка запоминается в последней: откат ее снимет.
+    """
+    if cow['private']:
+        return
+    blob_store.retain(blob)
+    if cow['frames']:
+        cow['frames'][-1]['retained'].append(blob)
+
+
+def push_frame(name, kind):
+    """
+    Запоминает текущую версию дерева как точку отката: 'snapshot' — явная (команда snapshot),
+    'undo' — автоматическая перед изменяющей командой (--undo N).
+    """
+    cow['frames'].append({
+        'name': name,
+        'kind': kind,
+        'vfs': params['vfs'],
+        'journal': journal['file'].seek(0, os.SEEK_END) if journal['file'] is not None and not cow['private'] else 0,
+        'retained': [],                                                 # blob, на которые появились ссылки после точки
+        'released': [],                                                 # удаленные поддеревья: ссылки снимутся, когда откат станет невозможен
+        'command': counters['commands'],
+    })
+    freeze()
+    undo_frames = [i for i, frame in enumerate(cow['frames']) if frame['kind'] == 'undo']
+    if len(undo_frames) > params.get('undo_depth', 0):                  # старые шаги отмены забываются
+        forget_frame(undo_frames[0])
+
+
+def forget_frame(position):
+    """
+    Удаляет точку отката без отката. Ее учет ссылок переходит к предыдущей точке,
+    а если предыдущей нет — отложенные удаления применяются.
+    """
+    frames = cow['frames']
+    frame = frames.pop(position)
+    if position > 0:
+        frames[position - 1]['retained'] += frame['retained']
+        frames[position - 1]['released'] += frame['released']
+    else:
+        for node in frame['released']:
+            release_subtree(node)
+
+
+def rollback_to(position):
+    """
+    Возвращает дерево к точке отката position; она и все более поздние точки удаляются.
+    """
+    frames = cow['frames']
+    while len(frames) > position:
+        frame = frames.pop()
+        if not cow['private']:
+            for blob in frame['retained']:
+                blob_store.release(blob)
+    params['vfs'] = frame['vfs']
+    freeze()                                                            # восстановленные узлы могут оставаться в других версиях
+    path_cache.clear()
+    if not cow['private']:
+        reset_node_index()                                              # индексы и name/parent узлов построятся заново
+        if journal['file'] is not None:                                 # журнал — ровно до точки отката
+            journal['file'].truncate(frame['journal'])
+    fix_cwd()
+
+
+def fix_cwd():
+    """
+    Если текущей папки нет в новой версии дерева, переходит в корень.
+    """
+    if not isinstance(resolve(params['current_working_directory']), FolderNode):
+        params['current_working_directory'] = ['root']
+
+
+def capture_view():
+    """
+    Текущее представление дерева (корень, кэш путей, точки отката, песочница ли).
+    """
+    return {'vfs': params['vfs'], 'path_cache': path_cache, 'frames': cow['frames'], 'private': cow['private']}
+
+
+def activate_view(view):
+    global path_cache
+    params['vfs'] = view['vfs']
+    path_cache = view['path_cache']
+    cow['frames'] = view['frames']
+    cow['private'] = view['private']
+
+
+def private_view():
+    """
+    Новая песочница: видит текущее дерево, но ее изменения видны только ей.
+    """
+    freeze()                                                            # дерево теперь общее у основной версии и песочницы
+    return {'vfs': params['vfs'], 'path_cache': OrderedDict(), 'frames': [], 'private': True}
+
+
+@command('snapshot', max_args=2, usage='snapshot: использование: snapshot [-l | <имя>]')
+def handle_snapshot(args):
+    """
+    snapshot [<имя>] — запоминает текущее дерево как точку отката (O(1), без копирования)
+    snapshot -l — список точек отката
+    """
+    if params['vfs'] is None:
+        print('Ошибка: VFS не загружен')
+        return False
+
+    if len(args) > 1 and args[1] == '-l':
+        for frame in cow['frames']:
+            print(f"{frame['name'] or '-'} ({'снимок' if frame['kind'] == 'snapshot' else 'шаг отмены'})")
+        return
+
+    name = args[1] if len(args) > 1 else str(sum(frame['kind'] == 'snapshot' for frame in cow['frames']) + 1)
+    push_frame(name, 'snapshot')
+    print(f"snapshot: сохранено состояние {name}")
+
+
+@command('undo')
+def handle_undo(args):
+    """
+    undo — отменяет последнюю изменяющую команду (с --undo N) или возвращает к последнему снимку
+    """
+    if not cow['frames']:
+        print("undo: нечего отменять")
+        return False
+    frame = cow['frames'][-1]
+    rollback_to(len(cow['frames']) - 1)
+    if frame['kind'] == 'snapshot':
+        print(f"undo: возврат к снимку {frame['name']}")
+    else:
+        print("undo: последнее изменение отменено")
+
 
-    command = args[0]
+@command('rollback', max_args=1, usage='rollback: использование: rollback [<имя снимка>]')
+def handle_rollback(args):
+    """
+    rollback [<имя>] — возвращает дерево к последнему (или названному) снимку, отменяя все изменения после него
+    """
+    positions = [i for i, frame in enumerate(cow['frames'])
+                 if frame['kind'] == 'snapshot' and (len(args) == 1 or frame['name'] == args[1])]
+    if not positions:
+        print(f"rollback: снимок {args[1]} не найден" if len(args) > 1 else "rollback: нет снимков")
+        return False
+    name = cow['frames'][positions[-1]]['name']
+    rollback_to(positions[-1])
+    print(f"rollback: возврат к снимку {name}")
 
-    if command == "exit":                                               # обработка команд
-        print("exit")
-        sys.exit(0)
 
-    elif command == "ls":                                               # вывод файлов и папок текущей директории
-        handle_ls(args)
+@command('sandbox', min_args=1, max_args=2, usage='sandbox: использование: sandbox on | off | run <скрипт>')
+def handle_sandbox(args):
+    """
+    sandbox on — дальнейшие изменения видны только этой сессии (песочница), sandbox off — отбросить их
+    sandbox run <скрипт> — выполнить скрипт в песочнице и отбросить изменения
+    """
+    if params['vfs'] is None:
+        print('Ошибка: VFS не загружен')
+        return False
 
-    elif command == "cd":                                               # смена рабочей директории
-        handle_cd(args)
+    mode = args[1]
+    if mode == 'on' and len(args) == 2:
+        if cow['private']:
+            print("sandbox: уже в песочнице")
+            return False
+        cow['saved'] = capture_view()
+        activate_view(private_view())
+        print("sandbox: изменения видны только в песочнице")
+    elif mode == 'off' and len(args) == 2:
+        if not cow['private']:
+            print("sandbox: песочница не включена")
+            return False
+        activate_view(cow['saved'])
+        cow['saved'] = None
+        fix_cwd()
+        print("sandbox: изменения отброшены")
+    elif mode == 'run' and len(args) == 3:
+        if not host_access('sandbox run'):                              # читает скрипт с хоста
+            return False
+        if cow['private']:
+            print("sandbox: уже в песочнице")
+            return False
+        try:
+            with open(args[2], 'r') as script:
+                program = compile_script(script.read().splitlines())
+        except OSError:
+            print(f"sandbox: файл скрипта {args[2]} не найден")
+            return False
+        cwd = params['current_working_directory']
+        cow['saved'] = capture_view()
+        activate_view(private_view())
+        try:
+            for lineno, line, found, parsed in program:
+                if not run_compiled(line, found, parsed):
+                    print(f"sandbox: ошибка в строке {lineno}")
+                    break
+        finally:
+            activate_view(cow['saved'])
+            cow['saved'] = None
+            params['current_working_directory'] = cwd
+        print("sandbox: изменения скрипта отброшены")
+    else:
+        print(COMMANDS['sandbox'].usage)
+        return False
 
-    elif command == "whoami":                                           # вывод имени пользователя
-        handle_whoami(args)
 
-    elif command == "history":                                          # вывод истории команд
-        handle_history(args)
+# ---------------------------------------------------------------------------
+# Изменения дерева и журнал. mv и chown меняют дерево только через mutate():
+# изменение сначала дописывается в журнал <vfs>.journal (одна короткая запись,
+# O(1) ввода-вывода), затем применяется. При загрузке журнал проигрывается
+# поверх XML (replay_journal), команда compact сворачивает его в новый XML.
+# Запись: длина полезной части и crc32 (<II), затем код операции (1 байт)
+# и поля: <H длина + UTF-8. Путь — имена от корня через \0. Пакет mv/chown по
+# шаблону, список имен которого не помещается в поле, пишется несколькими записями.
+# ---------------------------------------------------------------------------
 
-    elif command == "conf-dump":                                        # служебная команда для вывода конфигурации
-        for key, value in params.items():
-            print(f"{key} = {value}")
+JOURNAL_RECORD = struct.Struct('<II')                                   # длина полезной части, crc32
+JOURNAL_FIELD = struct.Struct('<H')                                     # длина поля
+JOURNAL_FIELD_MAX = (1 << 16) - 1                                       # наибольшая длина поля в байтах
+journal = {'file': None, 'path': None}                                  # открытый на дозапись журнал
 
-    elif command == "mv":                                               # перемещение/переименование объекта
-        handle_mv(args)
 
-    elif command == "chown":                                            # смена владельца объекта
-        handle_chown(args)
+def move_node(source_parts, destination_parts):
+    """
+    Переносит узел source_parts на место destination_parts; узел, который там был, заменяется.
+    Папка destination_parts[:-1] должна существовать.
+    """
+    source_folder = writable_folder(source_parts[:-1])
+    destination_folder = writable_folder(destination_parts[:-1])
+    name = destination_parts[-1]
+    move_child(source_folder, source_parts[-1], destination_folder, name)
+    invalidate_paths(source_parts, destination_parts)                   # пути под старым и новым местом больше не верны
 
-    else:                                                               # если неизвестная команда — сообщаем об ошибке
-        print(f"{command}: команда не найдена")
-        return False
 
-    return True
+def move_nodes(source_parts, names, destination_parts, new_names):
+    """
+    Переносит детей names папки source_parts в папку destination_parts под именами new_names
+    (mv по шаблону). Обе папки разрешаются, а кэш путей чистится один раз на весь пакет.
+    """
+    source_folder = writable_folder(source_parts)
+    destination_folder = writable_folder(destination_parts)
+    if source_folder is destination_folder:
+        changes = [(source_folder, source_folder.order, set(names), new_names)]
+    else:
+        changes = [(source_folder, source_folder.order, set(names), ()),
+                   (destination_folder, destination_folder.order, (), new_names)]
+    for folder, _, _, _ in changes:                                     # списки имен правятся один раз на пакет, а не по имени
+        folder.order = None
+    moved, replaced = [], []                                            # агрегаты предков правятся один раз на пакет
+    for name, new_name in zip(names, new_names):
+        move_child(source_folder, name, destination_folder, new_name, (moved, replaced))
+    add_totals(source_folder, nodes_totals(moved), -1)
+    add_totals(destination_folder, nodes_totals(replaced), -1)
+    add_totals(destination_folder, nodes_totals(moved), 1)
+    for folder, order, removed, added in changes:
+        if order is not None:
+            dropped = set(removed).union(added)
+            order = [name for name in order if name not in dropped]
+            order.extend(sorted(added))
+            order.sort()                                                # слияние двух отсортированных серий — линейно
+            folder.order = order
+    invalidate_children(source_parts, names)
+    invalidate_children(destination_parts, new_names)
+
+
+def move_child(source_folder, source_name, destination_folder, name, batch=None):
+    """
+    Переносит ребенка source_name изменяемой папки source_folder в изменяемую папку destination_folder
+    под именем name; узел, который там был, заменяется. Кэш путей не трогает.
+    batch — пара списков (перенесенные, замененные узлы): агрегаты тогда правит вызывающий, один раз на пакет.
+    """
+    node = thaw_child(source_folder, source_name)                       # у переносимого узла меняются name и parent
+    detach_child(source_folder, source_name)
+    replaced = destination_folder.children.get(name)
+    attach_child(destination_folder, name, node)
+    if batch is not None:
+        batch[0].append(node)
+        if replaced is not None:
+            batch[1].append(replaced)
+    else:                                                               # агрегаты меняются только у предков источника и назначения
+        adjust_totals(source_folder, node, -1)
+        if replaced is not None:
+            adjust_totals(destination_folder, replaced, -1)
+        adjust_totals(destination_folder, node, 1)
+
+    if replaced is not None:
+        drop_subtree(replaced)
+    if indexing():                                                      # поддеревья не переиндексируются: меняется только имя узла
+        if replaced is not None:
+            index_subtree(replaced, index_remove)
+        if node.name != name:
+            index_remove(node_index['name'], node.name, node)
+            index_add(node_index['name'], name, node)
+    node.name = name
+    node.parent = destination_folder
+
+
+def copy_node(source_parts, destination_parts):
+    """
+    Копирует узел source_parts (с поддеревом) на место destination_parts; узел, который там был, заменяется.
+    Содержимое файлов не копируется: копии ссылаются на те же blob. Еще не смонтированная
+    ленивая папка копируется заглушкой с тем же диапазоном в XML.
+    """
+    source = resolve(source_parts)
+    destination_folder = writable_folder(destination_parts[:-1])
+    name = destination_parts[-1]
+    copy = clone_node(source, name, destination_folder)
+    replaced = destination_folder.children.get(name)
+    if replaced is not None:
+        adjust_totals(destination_folder, replaced, -1)
+    attach_child(destination_folder, name, copy)
+    adjust_totals(destination_folder, copy, 1)
+    invalidate_paths(destination_parts)
+
+    if replaced is not None:
+        drop_subtree(replaced)
+    if indexing():
+        if replaced is not None:
+            index_subtree(replaced, index_remove)
+        index_subtree(copy, index_add)
+
+
+def clone_node(node, name, parent):
+    """
+    Копия узла с поддеревом для copy_node. Ленивые заглушки копируются, только пока у дерева
+    одна версия: монтирование копии взяло бы ссылки на blob, которые откат не снял бы.
+    """
+    epoch = cow['epoch']
+    stubs = not cow['frames'] and not cow['private']
+    if isinstance(node, FileNode):
+        retain_blob(node.blob)
+        return FileNode(node.owner, node.blob, name, parent, epoch)
+    if node.span is not None and stubs:
+        return FolderNode(node.owner, node.span, name, parent, epoch=epoch)
+    copy = FolderNode(node.owner, name=name, parent=parent, totals=copy_totals(node), epoch=epoch)
+    stack = [(node, copy)]
+    while stack:
+        original, folder = stack.pop()
+        for child_name, child in original.children.items():
+            if isinstance(child, FileNode):
+                retain_blob(child.blob)
+                folder._children[child_name] = FileNode(child.owner, child.blob, child_name, folder, epoch)
+            elif child.span is not None and stubs:
+                folder._children[child_name] = FolderNode(child.owner, child.span, child_name, folder, epoch=epoch)
+            else:
+                child_copy = folder._children[child_name] = FolderNode(child.owner, name=child_name, parent=folder,
+                                                                       totals=copy_totals(child), epoch=epoch)
+                stack.append((child, child_copy))
+        compact_children(folder)
+    return copy
+
+
+def copy_totals(folder):
+    return None if folder.totals is None else list(folder.totals)
+
+
+def drop_subtree(node):
+    """
+    Учитывает удаление поддерева из дерева: снимает ссылки на blob. Пока есть точки отката,
+    поддерево может вернуться, и ссылки снимаются, когда откат к ним станет невозможен.
+    """
+    if cow['private']:
+        return
+    if cow['frames']:
+        cow['frames'][-1]['released'].append(node)
+    else:
+        release_subtree(node)
 
 
-def run_script():
+def release_subtree(node):
     """
-    Функция для выполнения стартового скрипта.
-    Читает команды построчно и выполняет их, при первой ошибке выполнение прекращается.
+    Снимает ссылки на blob у всех файлов удаляемого поддерева.
+    Не смонтированные ленивые папки ссылок еще не брали.
     """
-    script_path = params["script_path"]
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, FileNode):
+            blob_store.release(node.blob)
+        elif node.span is None:
+            stack.extend(node._children.values())
 
-    if not os.path.exists(script_path):                                 # если стартовый скрипт не найден по пути
-        print(f"Ошибка: файл скрипта по пути {script_path} не найден")  # вывод ошибки
-        return False
 
-    with open(script_path, "r") as script:                              # открываем файл скрипта
-        for line in script:                                             # построчно читаем файл
-            line = line.strip()                                         # убираем лишние пробелы и \n
+def make_folder(parts, owner):
+    """
+    Создает пустую папку по пути parts.
+    """
+    parent = writable_folder(parts[:-1])
+    folder = FolderNode(owner, name=parts[-1], parent=parent, totals=[0, 0, 0], epoch=cow['epoch'])
+    attach_child(parent, parts[-1], folder)
+    adjust_totals(parent, folder, 1)
+    invalidate_paths(parts)
+    if indexing():
+        index_subtree(folder, index_add)
 
-            if not line:                                                # пропускаем пустые строки
-                continue
 
-            print(make_invite_line() + line)                            # вывод строки с промптом приглашения, чтобы выглядело как ввод пользователя
-            if not do_command(line):                                    # если выполнение команды завершилось ошибкой
-                print("Ошибка во время исполнения стартового скрипта.")
-                return False
-    return True
+def change_owner(parts, owner):
+    """
+    Меняет владельца узла по пути parts.
+    """
+    set_owner(thaw_child(writable_folder(parts[:-1]), parts[-1]), owner)
+    path_cache.pop(tuple(parts), None)                                  # узел мог быть заменен копией
 
 
-def load_vfs():
+def change_owner_recursive(parts, owner):
     """
-    Загружает VFS из XML-файла в память.
-    Возвращает словарь с виртуальной файловой системой.
+    Меняет владельца узла по пути parts и всех узлов в его поддереве (один обход поддерева).
     """
-    xml_path = params["vfs_path"]
-    if not xml_path or not os.path.exists(xml_path):                    # если не указан путь или файл не существует
-        print(f"Ошибка: файл VFS не найден: {xml_path}")                # выводим ошибку
-        return None
+    stack = [(writable_folder(parts[:-1]), parts[-1])]
+    while stack:
+        parent, name = stack.pop()
+        node = thaw_child(parent, name)
+        set_owner(node, owner)
+        if isinstance(node, FolderNode):
+            stack.extend((node, child_name) for child_name in list(node.children.keys()))
+    invalidate_paths(parts)
 
-    try:
-        tree = ET.parse(xml_path)                                       # пытаемся разобрать XML-файл
-        root_element = tree.getroot()                                   # получаем корневой элемент
-    except ET.ParseError as e:                                          # если XML некорректный
-        print(f"Ошибка: неверный формат XML VFS: {e}")                  # выводим ошибку
-        return None
 
+def change_owners(parts, names, owner):
+    """
+    Меняет владельца детей names папки parts (chown по шаблону): папка разрешается один раз.
+    """
+    folder = writable_folder(parts)
+    for name in names:
+        set_owner(thaw_child(folder, name), owner)
+        path_cache.pop(tuple(parts) + (name,), None)                    # узел мог быть заменен копией
 
-    def parse_folder(folder, owner='root'):                                           # рекурсивная функция, которая парсит папку за папкой в дереве иерархии
-        current_folder = {
-            "_type": 'folder',
-            "_owner": owner
-        }                                             # словарь хранения содержимого текущей папки
-        for element in folder:
-            name = element.attrib.get('name')
-            if element.tag == 'folder':                                 # если элемент - папка
-                current_folder[name] = parse_folder(element)
-            if element.tag == 'file':                                   # если элемент - файл
-                current_folder[name] = {
-                    "_type": "file",
-                    "_owner": owner,
-                    # декодируем содержимое base64 в байтовую строку. element.text - содержимое тега, если оно пустое, тогда "" (вместо None)
-                    "_content": base64.b64decode(element.text or "")
-                }
 
-        return current_folder
+def change_owners_recursive(parts, names, owner):
+    """
+    Меняет владельца детей names папки parts и всех узлов в их поддеревьях (chown -R по шаблону).
+    """
+    folder = writable_folder(parts)
+    stack = [(folder, name) for name in names]
+    while stack:
+        parent, name = stack.pop()
+        node = thaw_child(parent, name)
+        set_owner(node, owner)
+        if isinstance(node, FolderNode):
+            stack.extend((node, child_name) for child_name in list(node.children.keys()))
+    invalidate_children(parts, names)
+
+
+def set_owner(node, owner):
+    """
+    Меняет владельца одного узла, поддерживая индекс владельцев.
+    """
+    owner = sys.intern(owner)
+    if indexing() and node.owner != owner:
+        index_remove(node_index['owner'], node.owner, node)
+        index_add(node_index['owner'], owner, node)
+    node.owner = owner
+
+
+JOURNAL_OPS = {                                                         # код -> (функция, какие поля являются путями)
+    1: (move_node, (True, True)),
+    2: (make_folder, (True, False)),
+    3: (change_owner, (True, False)),
+    4: (change_owner_recursive, (True, False)),
+    5: (copy_node, (True, True)),
+    6: (move_nodes, (True, True, True, True)),                          # списки имен пишутся как пути: через \0
+    7: (change_owners, (True, True, False)),
+    8: (change_owners_recursive, (True, True, False)),
+}
+JOURNAL_CODES = {func: code for code, (func, _) in JOURNAL_OPS.items()}
+JOURNAL_BATCHES = {                                                     # пакетные операции -> номера параллельных списков имен
+    move_nodes: (1, 3),
+    change_owners: (1,),
+    change_owners_recursive: (1,),
+}
+
+
+def journal_records(func, fields):
+    """
+    Записи журнала для изменения func(*fields): список записей, каждая — закодированные поля.
+    Списки имен пакетной операции (JOURNAL_BATCHES) делятся между записями так, чтобы каждое
+    поле уместилось в JOURNAL_FIELD_MAX байт; проигрывание записей подряд дает тот же результат.
+    Возвращает None, если поле не помещается и так (например, одно очень длинное имя).
+    """
+    lists = JOURNAL_BATCHES.get(func, ())
+    chunks = [fields]
+    if lists:
+        chunks = []
+        start = 0
+        sizes = [0] * len(lists)
+        count = len(fields[lists[0]])
+        for i in range(count):
+            lengths = [len(fields[j][i].encode('utf-8')) + 1 for j in lists]  # имя и разделитель \0
+            if i > start and any(size + length - 1 > JOURNAL_FIELD_MAX for size, length in zip(sizes, lengths)):
+                chunks.append([field[start:i] if j in lists else field for j, field in enumerate(fields)])
+                start = i
+                sizes = [0] * len(lists)
+            sizes = [size + length for size, length in zip(sizes, lengths)]
+        chunks.append([field[start:] if j in lists else field for j, field in enumerate(fields)])
+
+    records = []
+    for chunk in chunks:
+        encoded = [('\0'.join(field) if isinstance(field, list) else field).encode('utf-8') for field in chunk]
+        if any(len(field) > JOURNAL_FIELD_MAX for field in encoded):
+            return None
+        records.append(encoded)
+    return records
+
 
-    vfs = {'root': parse_folder(root_element[0])}                       # парсим корневую папку, записываем в словарь root, т.к. при рекурсии она не учитывается
-    return vfs                                                          # возвращаем словарь с vfs
+def mutate(func, *fields):
+    """
+    Применяет изменение дерева func(*fields) (одну из JOURNAL_OPS), предварительно записав его в журнал.
+    С --undo N перед первым изменением каждой команды запоминается точка отката для undo.
+    В песочнице журнал не пишется. Если изменение нельзя записать в журнал, оно не применяется
+    и возвращается False.
+    """
+    records = None
+    if journal['file'] is not None and not cow['private']:
+        records = journal_records(func, fields)
+        if records is None:
+            print("Ошибка: изменение не помещается в запись журнала и не применено")
+            return False
+
+    frames = cow['frames']
+    if params.get('undo_depth') and not (frames and frames[-1]['kind'] == 'undo'
+                                         and frames[-1]['command'] == counters['commands']):
+        push_frame(None, 'undo')
+    if records is not None:
+        data = bytearray()
+        for encoded in records:
+            payload = bytearray([JOURNAL_CODES[func]])
+            for field in encoded:
+                payload += JOURNAL_FIELD.pack(len(field)) + field
+            data += JOURNAL_RECORD.pack(len(payload), zlib.crc32(payload)) + payload
+        journal['file'].write(data)                                     # записи пакета дописываются одной записью в файл
+        journal['file'].flush()
+    func(*fields)
+
+
+def read_journal(data):
+    """
+    Разбирает байты журнала. Возвращает (список (функция, поля), длина целой части журнала).
+    Недописанная или поврежденная запись в конце (сбой во время записи) и все после нее отбрасываются.
+    """
+    records = []
+    pos = 0
+    while pos + JOURNAL_RECORD.size <= len(data):
+        length, crc = JOURNAL_RECORD.unpack_from(data, pos)
+        payload = data[pos + JOURNAL_RECORD.size:pos + JOURNAL_RECORD.size + length]
+        if not length or len(payload) != length or zlib.crc32(payload) != crc or payload[0] not in JOURNAL_OPS:
+            break
+        func, path_fields = JOURNAL_OPS[payload[0]]
+        fields = []
+        offset = 1
+        for is_path in path_fields:
+            (size,) = JOURNAL_FIELD.unpack_from(payload, offset)
+            value = payload[offset + JOURNAL_FIELD.size:offset + JOURNAL_FIELD.size + size].decode('utf-8')
+            fields.append(value.split('\0') if is_path else value)
+            offset += JOURNAL_FIELD.size + size
+        records.append((func, fields))
+        pos += JOURNAL_RECORD.size + length
+    return records, pos
+
+
+def replay_journal(xml_path):
+    """
+    Проигрывает журнал <vfs>.journal поверх загруженного дерева и открывает его на дозапись.
+    Поврежденный хвост журнала обрезается.
+    """
+    journal_path = xml_path + '.journal'
+    try:
+        with open(journal_path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        data = b''
+
+    records, valid = read_journal(data)
+    skipped = 0
+    for func, fields in records:
+        try:
+            func(*fields)
+        except (AttributeError, KeyError):                              # запись не ложится на дерево (XML меняли вручную)
+            skipped += 1
+    if skipped:
+        print(f"Журнал: не применено записей: {skipped}")
+    if valid < len(data):
+        print(f"Журнал: отброшен поврежденный хвост ({len(data) - valid} байт)")
+
+    if journal['file'] is not None:
+        journal['file'].close()
+    journal['file'] = open(journal_path, 'ab')
+    if valid < len(data):
+        journal['file'].truncate(valid)
+    journal['path'] = journal_path
+
+
+def write_vfs_xml(out, root_folder):
+    """
+    Пишет дерево в XML VFS за один обход в глубину, элемент за элементом.
+    Владелец, отличный от root, сохраняется в атрибуте owner.
+    """
+    def attrs(name, node):
+        text = f' name={quoteattr(name)}'
+        if node.owner != 'root':
+            text += f' owner={quoteattr(node.owner)}'
+        return text
+
+    out.write('<filesystem>\n')
+    stack = [(1, 'root', root_folder)]
+    while stack:
+        depth, name, node = stack.pop()
+        indent = '    ' * depth
+        if node is None:                                                # маркер закрытия папки
+            out.write(f'{indent}</folder>\n')
+        elif isinstance(node, FolderNode):
+            out.write(f'{indent}<folder{attrs(name, node)}>\n')
+            stack.append((depth, None, None))
+            stack.extend((depth + 1, child_name, child) for child_name, child in reversed(list(node.children.items())))
+        else:
+            content = blob_store.base64(node.blob)
+            out.write(f'{indent}<file{attrs(name, node)}>{content}</file>\n')
+    out.write('</filesystem>')
 
 
-def get_folder(path):
+@command('compact')
+def handle_compact(args):
     """
-    Возвращает словарь текущей папки внутри VFS по списку path.
-    path — список папок от корня, вида *['root', 'home', 'user']
+    compact — сворачивает журнал изменений в новый XML VFS (и снимок) и очищает журнал
     """
-    out_folder = params["vfs"]                                          # создаем аутпут папку и кладем туда vfs
+    xml_path = params.get('vfs_path')
+    if params['vfs'] is None:
+        print('Ошибка: VFS не загружен')
+        return False
 
-    for folder in path:
-        if folder not in out_folder or out_folder[folder]['_type'] != 'folder':      # если папки нет или она не является словарем
-            return None
-        out_folder = out_folder[folder]                                 # переходим в следующую папку
+    if cow['private']:
+        print('compact: недоступно в песочнице')
+        return False
+    if not host_access('compact'):                                      # перезаписывает общий XML на диске
+        return False
+
+    root_folder = params['vfs'].children['root']
+    temp = f"{xml_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp, 'w', encoding='utf-8') as out:
+            write_vfs_xml(out, root_folder)
+        os.replace(temp, xml_path)                                      # атомарная замена XML
+    except OSError as e:
+        print(f"compact: не удалось записать {xml_path}: {e}")
+        return False
 
-    return out_folder                                                   # возвращаем словарь искомой папки
+    if journal['file'] is not None:
+        journal['file'].truncate(0)
+    while cow['frames']:                                                # журнал очищен — откатываться больше не к чему
+        forget_frame(0)
+    if params.get('cache', True):
+        save_snapshot(xml_path, root_folder)
+    print(f"compact: VFS сохранена в {xml_path}")
 
 
+@command('ls')
 def handle_ls(args):
     """
-    ls - выводит содержимое текущей папки VFS
+    ls [-l] [--owner <владелец>] [--limit N] [--offset N] [путь] [шаблон] - выводит содержимое папки VFS
+    (по умолчанию текущей) по возрастанию имен; шаблон fnmatch (*, ?, [...]) оставляет только подходящие имена,
+    его можно указать и последним именем пути (ls docs/*.txt)
+    -l добавляет тип, размер (для папки — всего поддерева) и число детей папки
+    --owner оставляет только объекты этого владельца
+    --offset пропускает первые N объектов, --limit выводит не больше N (страница)
     """
     vfs = params['vfs']                                                 # получаем vfs из параметров
     if vfs is None:                                                     # если vfs не загружен
         print("Ошибка: VFS не загружен")
         return
-    folder = get_folder(params["current_working_directory"])            # получаем словарь текущей папки
-    for name, content in folder.items():                                # перебираем элементы текущей папки
-        if name[0] == '_':
-            continue
-        if content['_type'] == "folder":                                # если элемент — папка (т.е. содержимое словарь)
-            print(f'{name}/ (owner: {content["_owner"]})')              # обозначаем папку "/"
-        else:                                                           # если элемент — файл
-            print(f'{name} (owner: {content["_owner"]})')                                                 # выводим имя файла
+
+    owner = None
+    long_format = False
+    limit = None
+    offset = 0
+    positional = []
+    rest = args[1:]
+    while rest:
+        if rest[0] == '--owner' and len(rest) > 1:
+            owner = rest[1]
+            rest = rest[2:]
+        elif rest[0] in ('--limit', '--offset') and len(rest) > 1:
+            if not rest[1].isdigit():
+                print(f"ls: {rest[0]}: ожидалось неотрицательное число, получено {rest[1]}")
+                return
+            if rest[0] == '--limit':
+                limit = int(rest[1])
+            else:
+                offset = int(rest[1])
+            rest = rest[2:]
+        elif rest[0] == '-l':
+            long_format = True
+            rest = rest[1:]
+        elif rest[0].startswith('-') or len(positional) == 2:
+            print(f"ls: неизвестный аргумент {rest[0]}")
+            return
+        else:
+            positional.append(rest[0])
+            rest = rest[1:]
+
+    pattern = None
+    if len(positional) == 2:
+        path_str, pattern = positional
+    elif positional and resolve(normalize_path(positional[0])) is None and split_glob(positional[0]):
+        path_str, pattern = split_glob(positional[0])                   # ls *.txt, ls docs/f?.txt
+    else:
+        path_str = positional[0] if positional else '.'
+
+    parts = normalize_path(path_str)
+    node = resolve(parts)
+    if node is None:
+        print(f"ls: {path_str}: объект не найден")
+        return
+    if isinstance(node, FileNode):                                      # ls файла — одна строка о нем
+        folder, names = get_folder(parts[:-1]), [parts[-1]]             # parent у общих версий узла может быть устаревшим
+        if pattern is not None:
+            print(f"ls: {path_str}: не папка")
+            return
+    else:
+        folder = node
+        if owner is not None:
+            owned = owned_children(folder, owner)
+            names = [name for name, _ in owned]
+            if pattern is not None:
+                match = re.compile(fnmatch.translate(pattern)).match
+                names = [name for name in names if match(name)]
+        elif pattern is not None:
+            names = iter_matches(folder, pattern)                       # генератор: страница не требует перебора всех совпадений
+        else:
+            names = sorted_names(folder)
+
+    children = folder.children
+    end = None if limit is None else offset + limit
+    if isinstance(names, list):
+        page = names[offset:end]
+        more = end is not None and end < len(names)
+    else:
+        page = list(itertools.islice(names, offset, end))
+        more = end is not None and next(names, None) is not None
+
+    lines = []
+    for name in page:
+        content = children[name]
+        if long_format:                                                 # размер папки — из ее агрегатов, без обхода поддерева
+            if isinstance(content, FolderNode):
+                lines.append(f'd {content.owner:<10} {folder_totals(content)[0]:>10} {len(content.children):>6} {name}/')
+            else:
+                lines.append(f'- {content.owner:<10} {content.blob.size:>10} {"-":>6} {name}')
+        elif isinstance(content, FolderNode):                           # папку обозначаем "/"
+            lines.append(f'{name}/ (owner: {content.owner})')
+        else:
+            lines.append(f'{name} (owner: {content.owner})')
+    if more:
+        lines.append(f"-- есть еще объекты: ls ... --offset {end}")
+    if lines:
+        sys.stdout.write('\n'.join(lines) + '\n')                       # страница выводится одной записью
+    elif pattern is not None and not offset:
+        print(f"ls: {pattern}: нет совпадений")
 
 
+@command('cd', min_args=1, max_args=1, usage='cd: не указан путь',
+         too_many='cd: много аргументов (ожидался 1, получено {count})')
 def handle_cd(args):
     """
     cd — изменяет текущую виртуальную директорию внутри VFS.
@@ -205,6 +2648,7 @@ def handle_cd(args):
     - cd <folder>   -> переход в подпапку
     - cd /<path>    -> абсолютный путь от root
     - cd ~/<path>   -> абсолютный путь от home/user
+    в любом пути допускаются '.' и '..', например cd ../docs/./x
     """
 
     vfs = params['vfs']                                                 # получаем vfs из параметров
@@ -212,66 +2656,31 @@ def handle_cd(args):
         print('Ошибка: VFS не загружен')
         return
 
-    if len(args) == 1:                                                  # если путь не указан
-        print('cd: не указан путь')
-        return
-
-    if len(args[1:]) > 1:                                               # если аргументов передано больше 1
-        print(f'cd: много аргументов (ожидался 1, получено {len(args[1:])})')
-        return
-
     target = args[1]                                                    # аргумент команды cd
 
-    if target == '/':                                                   # абсолютный путь в корень
-        params['current_working_directory'] = ['root']
-        return
-
-    elif target == '~':                                                 # домашняя папка
-        params['current_working_directory'] = ['root', 'home', 'user']
-        return
-
-    elif target == '..':                                                # подняться на уровень выше
-        if len(params['current_working_directory']) > 1:                # если мы не в руте
-            params['current_working_directory'].pop()                   # удаляем последний элемент
-        else:
-            print('cd: уже в корне')
-        return
-
-    elif target[0] == '/':                                               # если указан абсолютный путь от корня
-        parts = ["root"] + [i for i in target.split("/") if i]          # получаем список из папок переданного пути, if i для отброски пустой строки в начале
-        folder = get_folder(parts)                                      # получаем искомую папку
-        if folder is not None:                                          # если папка существует
-            params['current_working_directory'] = parts                 # записываем ее в текущую рабочую папку
-        else:
-            print('cd: такого пути не существует')                      # иначе ошибка
-        return
-
-    elif target[0] == '~':                                               # аналогично абсолютному пути, только от домашней папки
-        parts = ["root", "home", "user"] + [i for i in target.split("/") if i != '~'] # if i чтобы ~ в начале пустую строку
-        folder = get_folder(parts)                                      # получаем искомую папку
-        if folder is not None:                                          # если папка существует
-            params['current_working_directory'] = parts                 # записываем ее в текущую рабочую папку
-        else:
-            print('cd: такого пути не существует')                      # иначе ошибка
+    if target == '..' and len(params['current_working_directory']) == 1:  # подняться выше корня нельзя
+        print('cd: уже в корне')
         return
 
-    else:                                                               # когда переход в подпапку
-        current_folder = get_folder(params["current_working_directory"])# получаем словарь текущей рабочей папка
-
-        if target in current_folder and isinstance(current_folder[target], dict): # если в текущей рабочей папке есть искомая и она словарь
-            params['current_working_directory'].append(target)          # добавляем в путь эту папку
-            return
-        print('cd: папка не найдена')                                   # если не нашли - вывод ошибки
+    parts = normalize_path(target)                                      # список папок от корня с учетом ~, . и ..
+    if get_folder(parts) is not None:                                   # если папка существует
+        params['current_working_directory'] = parts                     # записываем ее в текущую рабочую папку
+    elif target[0] in '/~':                                             # абсолютный путь или путь от домашней папки
+        print('cd: такого пути не существует')
+    else:                                                               # относительный путь
+        print('cd: папка не найдена')
 
 
+@command('whoami')
 def handle_whoami(args):
     """
     whoami — выводит имя пользователя
     """
-    user = getpass.getuser()                                            # получение имя юзера системы
+    user, _ = system_identity()                                         # получение имя юзера системы
     print(user)
 
 
+@command('history')
 def handle_history(args):
     """
     history — выводит историю команд по номерам
@@ -280,33 +2689,27 @@ def handle_history(args):
         print(f'{index + 1} {command}')
 
 
+@command('mv', min_args=2, max_args=2, usage='mv: требуется два аргумента: <источник> <пункт назначения>')
 def handle_mv(args):
     """
     mv <источник> <пункт назначения> — перемещает файл или папку внутри vfs
     также может переименовывать файл, если пункт назначения - файл а не папка
+    источник может быть шаблоном в последнем имени (см. move_matches)
     """
-    if len(args) != 3:                                                  # проверка количества аргументов (должно быть 3)
-        print("mv: требуется два аргумента: <источник> <пункт назначения>")
-        return
-
     source_path, destination_path = args[1], args[2]                    # исходный объект и новое имя/путь
 
-    if source_path.startswith('/'):                                     # абсолютный путь источника
-        source_parts = ["root"] + [i for i in source_path.split("/") if i]
-    else:                                                               # относительный путь источника от текущей директори
-        source_parts = params["current_working_directory"] + [i for i in source_path.split("/") if i]
+    source_parts = normalize_path(source_path)                          # полный путь источника от корня
+    destination_parts = normalize_path(destination_path)                # полный путь объекта назначения от корня
 
-    if destination_path.startswith('/'):                                # абсолютный путь объекта назначения
-        destination_parts = ["root"] + [i for i in destination_path.split("/") if i]
-    else:                                                               # относительный путь об. наз. от текущей директори
-        destination_parts = params["current_working_directory"] + [i for i in destination_path.split("/") if i]
+    if resolve(source_parts) is None and split_glob(source_path):       # источника с таким именем нет — это шаблон
+        return move_matches(source_path, destination_path)
 
-    source_folder = get_folder(source_parts[:-1])                       # папка исходного объекта
+    source_folder = get_folder(source_parts[:-1]) if len(source_parts) > 1 else None  # папка исходного объекта (корень переносить нельзя)
     source_name = source_parts[-1]                                      # имя исходного объекта
     destination_folder = get_folder(destination_parts[:-1])             # папка объекта назначения
     destination_name = destination_parts[-1]                            # имя объекта назначения
 
-    if source_folder is None or source_name not in source_folder:       # если исходная папка не найдена или объекта нет в найденной папке
+    if source_folder is None or source_name not in source_folder.children:  # если исходная папка не найдена или объекта нет в найденной папке
         print(f"mv: исходный объект {source_path} не найден")           # вывод ошибки
         return
 
@@ -314,51 +2717,379 @@ def handle_mv(args):
         print(f"mv: папка назначения {destination_path} не найдена")    # вывод ошибки
         return
 
-    object = source_folder.pop(source_name)                             # получаем объект для переноса, при этом удаляя его из исходной папка
+    if len(destination_parts) > len(source_parts) and destination_parts[:len(source_parts)] == source_parts:
+        print(f"mv: нельзя переместить '{source_path}' внутрь самого себя")  # иначе в дереве появится цикл
+        return
+
+    object = source_folder.children[source_name]                        # объект для переноса
+    destination_object = destination_folder.children.get(destination_name)  # объект назначения (файл, папка или None)
+
+    if destination_object is object:                                    # mv x x
+        print(f"mv: '{source_path}' и '{destination_path}' — один и тот же объект")
+        return
+
+    # если объект назначения - файл, а исходный - папка, то выдаем ошибку. Нельзя перенести папку в файл
+    if isinstance(object, FolderNode) and isinstance(destination_object, FileNode):
+        print(f"mv: нельзя переместить каталог '{source_path}' в файл '{destination_path}'")
+        return
+
+    if isinstance(destination_object, FolderNode):                      # если объект назначения - папка
+        if mutate(move_node, source_parts, destination_parts + [source_name]) is False:  # в эту папку кладем объект переноса по имени (не важно папка или файл)
+            return False
+        print(f"{source_path} -> {destination_path} перемещено внутрь существующей папки")
+        return
+
+    if destination_object is None and '.' not in str(destination_name):  # если новый объект назначения - папка
+        if mutate(make_folder, destination_parts, 'root') is False:
+            return False
+        if mutate(move_node, source_parts, destination_parts + [source_name]) is False:
+            return False
+    elif mutate(move_node, source_parts, destination_parts) is False:   # если объект назначения - файл (новый или перезаписываемый)
+        return False
+    print(f"{source_path} -> {destination_path}: перемещено и/или переименовано")
+
 
-    if destination_name in destination_folder:                          # если объект назначения есть в папке назначения (файл или папка существует)
-        destination_object = destination_folder[destination_name]       # получаем объект назначения (файл или папка)
+def move_matches(source_path, destination_path):
+    """
+    mv по шаблону. mv <путь/шаблон> <папка> переносит все подходящие объекты в существующую папку,
+    mv <шаблон с *> <шаблон с *> переименовывает их, подставляя часть имени, совпавшую со *
+    (mv 'img_*.png' 'old/pic_*.png'). Папки разрешаются один раз, весь пакет — одно изменение дерева.
+    """
+    folder_path, pattern = split_glob(source_path)
+    source_parts = normalize_path(folder_path)
+    source_folder = get_folder(source_parts)
+    if source_folder is None:
+        print(f"mv: папка {folder_path} не найдена")
+        return
+    names = list(iter_matches(source_folder, pattern))
+    if not names:
+        print(f"mv: {source_path}: нет совпадений")
+        return
 
-        # если объект назначения - файл, а исходный - папка, то выдаем ошибку. Нельзя перенести папку в файл
-        if isinstance(object, dict) and not isinstance(destination_object, dict):
-            print(f"mv: нельзя переместить каталог '{source_path}' в файл '{destination_path}'")
+    destination_folder_path = destination_path
+    renaming = split_glob(destination_path)
+    if renaming is not None:                                            # назначение тоже шаблон — переименование
+        destination_folder_path, template = renaming
+        if any(part.count('*') != 1 or GLOB_CHARS.search(part.replace('*', '')) for part in (pattern, template)):
+            print("mv: для переименования по шаблону нужно ровно по одной * в источнике и назначении (без ? и [...])")
             return
+        head, tail = pattern.split('*')
+        new_head, new_tail = template.split('*')
+        new_names = [new_head + name[len(head):len(name) - len(tail)] + new_tail for name in names]
+    else:
+        new_names = names
+
+    destination_parts = normalize_path(destination_folder_path)
+    destination_folder = get_folder(destination_parts)
+    if destination_folder is None:
+        print(f"mv: папка назначения {destination_folder_path} не найдена")
+        return
 
-        if isinstance(destination_object, dict):                        # если объект назначения - папка
-            destination_object[source_name] = object                    # в эту папку кладем объект переноса по имени (не важно папка или файл)
-            print(f"{source_path} -> {destination_path} перемещено внутрь существующей папки")
-        else:                                                           # если объект назначения - файл
-            destination_folder[destination_name] = object               # то перезаписываем файл на файл для переноса
-            print(f"{source_path} -> {destination_path}: перемещено и/или переименовано")
-    else:                                                               # если объект назначения нет в папке назначения (файл или папка не существует)
-        if '.' not in str(destination_name):                            # если новый объект назначения - папка
-            destination_folder[destination_name] = {source_name: object}
+    same_folder = destination_parts == source_parts
+    if same_folder and new_names == names:
+        print(f"mv: {source_path} и {destination_path} — одни и те же объекты")
+        return
+    if same_folder:                                                     # цепочки a -> b, b -> c зависят от порядка переносов
+        moving = set(names)
+        for name, new_name in zip(names, new_names):
+            if new_name != name and new_name in moving:
+                print(f"mv: новое имя {new_name} совпадает с именем другого переносимого объекта")
+                return
+
+    children = source_folder.children
+    batch, batch_names = [], []
+    for name, new_name in zip(names, new_names):
+        node = children[name]
+        existing = destination_folder.children.get(new_name)
+        if same_folder and new_name == name:
+            print(f"mv: {name}: источник и назначение совпадают")
+        elif destination_parts[:len(source_parts) + 1] == source_parts + [name]:
+            print(f"mv: нельзя переместить '{name}' внутрь самого себя")
+        elif isinstance(existing, FolderNode):
+            print(f"mv: {new_name}: в папке назначения уже есть папка с таким именем")
+        elif isinstance(node, FolderNode) and existing is not None:
+            print(f"mv: нельзя заменить файл '{new_name}' каталогом '{name}'")
         else:
-            destination_folder[destination_name] = object               # если новый объект назначения - файл
-        print(f"{source_path} -> {destination_path}: перемещено и/или переименовано")
+            batch.append(name)
+            batch_names.append(new_name)
 
+    if batch:
+        if mutate(move_nodes, source_parts, batch, destination_parts, batch_names) is False:
+            return False
+        print(f"{source_path} -> {destination_path}: перемещено объектов: {len(batch)}")
 
-def handle_chown(args):
-    if len(args) != 3:                                                  # проверяем, что передано ровно 2 аргумента
-        print('chown: требуется два аргумента: <пользователь> <путь к объекту>')
+
+@command('cp', min_args=2, max_args=3, usage='cp: требуется два аргумента: [-r] <источник> <пункт назначения>')
+def handle_cp(args):
+    """
+    cp [-r] <источник> <пункт назначения> — копирует файл (с -r — папку) внутри vfs
+    содержимое не копируется: копия ссылается на то же содержимое в хранилище
+    """
+    recursive = args[1] == '-r'
+    if len(args) != (4 if recursive else 3):
+        print(COMMANDS['cp'].usage)
+        return
+
+    source_path, destination_path = args[-2], args[-1]                  # исходный объект и путь копии
+
+    source_parts = normalize_path(source_path)                          # полный путь источника от корня
+    destination_parts = normalize_path(destination_path)                # полный путь объекта назначения от корня
+    object = resolve(source_parts) if len(source_parts) > 1 else None   # копируемый объект (корень копировать нельзя)
+    destination_folder = get_folder(destination_parts[:-1])             # папка объекта назначения
+
+    if object is None:
+        print(f"cp: исходный объект {source_path} не найден")
+        return
+
+    if isinstance(object, FolderNode) and not recursive:
+        print(f"cp: '{source_path}' — папка, используйте cp -r")
+        return
+
+    if destination_folder is None:                                      # если папка назначения не найдена
+        print(f"cp: папка назначения {destination_path} не найдена")
+        return
+
+    destination_object = destination_folder.children.get(destination_parts[-1])
+    if isinstance(destination_object, FolderNode):                      # копируем внутрь существующей папки
+        destination_parts = destination_parts + [source_parts[-1]]
+        destination_object = destination_object.children.get(source_parts[-1])
+
+    if destination_object is object:                                    # cp x x
+        print(f"cp: '{source_path}' и '{destination_path}' — один и тот же объект")
+        return
+
+    if len(destination_parts) > len(source_parts) and destination_parts[:len(source_parts)] == source_parts:
+        print(f"cp: нельзя скопировать '{source_path}' внутрь самого себя")
+        return
+
+    if isinstance(object, FolderNode) and isinstance(destination_object, FileNode):
+        print(f"cp: нельзя скопировать каталог '{source_path}' в файл '{destination_path}'")
+        return
+
+    if isinstance(object, FileNode) and isinstance(destination_object, FolderNode):
+        print(f"cp: нельзя заменить каталог '{destination_path}' файлом '{source_path}'")
+        return
+
+    if mutate(copy_node, source_parts, destination_parts) is False:
+        return False
+    print(f"{source_path} -> {destination_path}: скопировано")
+
+
+MEMORY_TOP = 10                                                         # сколько строк кода показывать в разделе памяти stats
+PROFILE_TOP = 20                                                        # сколько функций показывать в отчете profile
+
+
+def format_ns(ns):
+    """
+    Длительность в наносекундах в удобных единицах: мкс, мс или с.
+    """
+    if ns < 1_000_000:
+        return f"{ns / 1000:.0f} мкс"
+    if ns < 1_000_000_000:
+        return f"{ns / 1_000_000:.1f} мс"
+    return f"{ns / 1_000_000_000:.2f} с"
+
+
+def histogram_bound(bucket):
+    """
+    Верхняя граница корзины гистограммы задержек (в наносекундах).
+    """
+    return (1 << bucket) * 1000
+
+
+def histogram_percentile(histogram, fraction):
+    """
+    Оценка перцентиля по гистограмме: верхняя граница корзины, в которую он попал.
+    """
+    limit = sum(histogram) * fraction
+    seen = 0
+    for bucket, count in enumerate(histogram):
+        seen += count
+        if count and seen >= limit:
+            return histogram_bound(bucket)
+    return histogram_bound(len(histogram) - 1)
+
+
+def stats_store():
+    store = blob_store
+    ratio = store.logical_bytes / store.stored_bytes if store.stored_bytes else 1.0
+    print(f"Файлов: {store.files}")
+    print(f"Уникального содержимого: {len(store.blobs)}")
+    print(f"Объем файлов: {store.logical_bytes} байт")
+    print(f"Хранится: {store.stored_bytes} байт")
+    print(f"Дедупликация: {ratio:.2f}x")
+    if store.disk_file is not None:
+        print(f"На диске: {store.disk_size} байт")
+
+
+def stats_tree():
+    totals = get_folder(['root']).totals                                # в ленивом режиме итоги есть только у смонтированного
+    if totals is None:
+        print("Дерево: итоги еще не посчитаны (du -s /)")
+    else:
+        print(f"Дерево: папок {totals[2]}, файлов {totals[1]}, {totals[0]} байт")
+    hits, walks = counters['path_hits'], counters['path_walks']
+    print(f"Разрешение путей: из кэша {hits}, с обходом {walks} (узлов пройдено: {counters['path_steps']})")
+
+
+def stats_load():
+    if not load_phases:
+        print("Загрузка: VFS не загружался")
+        return
+    print(f"Загрузка: {format_ns(int(sum(load_phases.values()) * 1e9))}")
+    for name, seconds in load_phases.items():
+        print(f"  {PHASE_NAMES[name]}: {format_ns(int(seconds * 1e9))}")
+    print(f"  декодирование base64 (по мере чтения): {blob_store.decoded} blob, {format_ns(blob_store.decode_ns)}")
+    if counters['output_bytes']:
+        print(f"Вывод скриптов: {counters['output_bytes']} символов, {format_ns(counters['output_ns'])}")
+
+
+def stats_commands():
+    print(f"Команд выполнено: {counters['commands']}")
+    for name, (calls, total_ns, histogram) in sorted(command_stats.items(), key=lambda item: -item[1][1]):
+        print(f"  {name}: вызовов {calls}, всего {format_ns(total_ns)}, среднее {format_ns(total_ns // calls)}, "
+              f"p50 < {format_ns(histogram_percentile(histogram, 0.5))}, p99 < {format_ns(histogram_percentile(histogram, 0.99))}")
+        print('    ' + ', '.join(f"< {format_ns(histogram_bound(bucket))}: {count}"
+                                 for bucket, count in enumerate(histogram) if count))
+
+
+def stats_memory():
+    tracemalloc = sys.modules.get('tracemalloc')                        # импортируется только с --profile
+    if tracemalloc is None or not tracemalloc.is_tracing():
+        print("Память: трассировка выключена (запустите с --profile)")
+        return
+    current, peak = tracemalloc.get_traced_memory()
+    print(f"Память: сейчас {current} байт, пик {peak} байт")
+    snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+    for stat in snapshot.statistics('lineno')[:MEMORY_TOP]:
+        frame = stat.traceback[0]
+        print(f"  {os.path.basename(frame.filename)}:{frame.lineno}: {stat.size} байт ({stat.count} блоков)")
+
+
+STATS_SECTIONS = {                                                      # раздел stats -> (функция, нужен ли загруженный VFS)
+    'store': (stats_store, True),
+    'tree': (stats_tree, True),
+    'load': (stats_load, False),
+    'commands': (stats_commands, False),
+    'memory': (stats_memory, False),
+}
+
+
+def print_stats():
+    """
+    Все разделы stats подряд (разделы, которым нужен VFS, пропускаются, если он не загружен).
+    """
+    for func, needs_vfs in STATS_SECTIONS.values():
+        if not needs_vfs or params['vfs'] is not None:
+            func()
+
+
+@command('stats', max_args=1, usage='stats: лишние аргументы: stats [store|tree|load|commands|memory|reset]')
+def handle_stats(args):
+    """
+    stats [раздел] — статистика работы оболочки: хранилище содержимого (store), дерево и разрешение путей (tree),
+    этапы загрузки VFS (load), вызовы и задержки команд (commands), память по строкам кода (memory, с --profile)
+    stats reset — обнуляет счетчики команд, путей и вывода
+    """
+    if len(args) == 1:
+        print_stats()
+        return
+
+    if args[1] == 'reset':
+        command_stats.clear()
+        for key in counters:
+            if key != 'commands':                                       # по числу команд версии дерева отличают отмененные команды
+                counters[key] = 0
         return
 
-    new_owner, path_str = args[1], args[2]                               # получаем имя нового владельца и путь к объекту
+    section = STATS_SECTIONS.get(args[1])
+    if section is None:
+        print(f"stats: неизвестный раздел: {args[1]}")
+        return False
+    func, needs_vfs = section
+    if needs_vfs and params['vfs'] is None:
+        print('Ошибка: VFS не загружен')
+        return False
+    func()
+
+
+def report_profile():
+    """
+    Отчет --profile при завершении оболочки: все разделы stats в stderr.
+    """
+    with contextlib.redirect_stdout(sys.stderr):
+        print("Профиль:")
+        print_stats()
+
+
+@command('profile', min_args=1, usage='profile: требуется команда: profile [-o файл] <команда> [аргументы...]')
+def handle_profile(args):
+    """
+    profile [-o файл] <команда> [аргументы...] — выполняет одну команду под cProfile
+    и печатает самые затратные функции; с -o профиль сохраняется в файл (для pstats)
+    """
+    rest = args[1:]
+    dump_path = None
+    if rest[0] == '-o':
+        if len(rest) < 3:
+            print(COMMANDS['profile'].usage)
+            return False
+        dump_path, rest = rest[1], rest[2:]
+        if not host_access('profile -o'):                               # пишет файл на хосте
+            return False
+    if COMMANDS.get(rest[0]) is COMMANDS['profile']:
+        print('profile: профиль профиля не снимается')
+        return False
+
+    import cProfile                                                     # нужны только этой команде, при старте не загружаются
+    import pstats
+    profiler = cProfile.Profile()
+    result = profiler.runcall(execute_command, rest)
+    pstats.Stats(profiler, stream=sys.stdout).strip_dirs().sort_stats('cumulative').print_stats(PROFILE_TOP)
+    if dump_path is not None:
+        try:
+            profiler.dump_stats(dump_path)
+        except OSError as e:
+            print(f"profile: не удалось записать {dump_path}: {e.strerror}")
+            return False
+    return result
+
 
-    if path_str.startswith('/'):                                        # путь от рута
-        path_parts = ["root"] + [i for i in path_str.split("/") if i]
-    else:                                                               # относительный путь от текущей директории
-        path_parts = params["current_working_directory"] + [i for i in path_str.split("/") if i]
+@command('chown', min_args=2, max_args=3, usage='chown: требуется два аргумента: [-R] <пользователь> <путь к объекту>')
+def handle_chown(args):
+    """
+    chown [-R] <пользователь> <путь> — меняет владельца файла или папки
+    с -R — владельца всего поддерева папки
+    путь может оканчиваться шаблоном (chown user docs/*.txt) — меняются все подходящие объекты
+    """
+    recursive = args[1] == '-R'
+    if len(args) != (4 if recursive else 3):
+        print(COMMANDS['chown'].usage)
+        return
 
-    parent_folder = get_folder(path_parts[:-1])                         # получаем папку, в которой находится объект
-    name = path_parts[-1]                                               # имя объекта внутри этой папки
+    new_owner, path_str = args[-2], args[-1]                            # получаем имя нового владельца и путь к объекту
 
-    if parent_folder is None or name not in parent_folder:              # если папка не существует или объект не найден
+    path_parts = normalize_path(path_str)                               # путь к объекту (абсолютный, от ~ или относительный)
+    if resolve(path_parts) is None and split_glob(path_str):            # объекта с таким именем нет — это шаблон
+        folder_path, pattern = split_glob(path_str)
+        folder_parts = normalize_path(folder_path)
+        folder = get_folder(folder_parts)
+        names = list(iter_matches(folder, pattern)) if folder is not None else []
+        if not names:
+            print(f"chown: {path_str}: нет совпадений")
+            return
+        if mutate(change_owners_recursive if recursive else change_owners, folder_parts, names, new_owner) is False:
+            return False                                                # одно изменение дерева на все совпадения
+        print(f"{path_str}: владелец изменён на {new_owner} (объектов: {len(names)})")
+        return
+
+    if resolve(path_parts) is None:                                     # если папка не существует или объект не найден
         print(f"chown: объект {path_str} не найден")
         return
 
-    obj = parent_folder[name]                                           # получен объект
-    obj["_owner"] = new_owner                                           # меняем владельца
+    operation = change_owner_recursive if recursive else change_owner   # с -R — одна запись в журнале на все поддерево
+    if mutate(operation, path_parts, new_owner) is False:
+        return False
     print(f"{path_str}: владелец изменён на {new_owner}")
 
 def repl():
@@ -382,24 +3113,185 @@ def repl():
             print(f"Внутренняя ошибка: {e}")
 
 
+# ---------------------------------------------------------------------------
+# Режим сервера (--serve): VFS загружается один раз, сессии подключаются по
+# TCP или Unix-сокету и работают с общим деревом. У каждой сессии свои текущая
+# папка, приглашение и история. Команды выполняются в цикле asyncio целиком,
+# без await внутри, поэтому изменения дерева от разных сессий не перемешиваются.
+# Протокол: клиент шлет строку команды, сервер отвечает ее выводом и новым
+# приглашением, в конце ответа — байт \0. Первый ответ — только приглашение.
+# ---------------------------------------------------------------------------
+
+server_state = {'sessions': 0, 'remote': False}                         # число открытых сессий; выполняется ли команда клиента сервера
+
+
+class Session:
+    """
+    Состояние одной сессии сервера: текущая папка, история команд и песочница
+    (view — представление дерева сессии, None — общее дерево).
+    """
+    __slots__ = ('cwd', 'history', 'view')
+
+    def __init__(self):
+        self.cwd = ['root']
+        self.history = []
+        self.view = private_view() if params.get('private_sessions') and params['vfs'] is not None else None
+
+
+def host_access(name):
+    """
+    Команды, которые читают или пишут файлы хоста (compact, profile -o, sandbox run), доступны
+    стартовому скрипту и REPL, но не клиентам сервера. Для команды клиента печатает ошибку и возвращает False.
+    """
+    if server_state['remote']:
+        print(f"{name}: недоступно в сессии сервера")
+        return False
+    return True
+
+
+def session_command(session, line):
+    """
+    Выполняет строку команды от имени сессии: подставляет ее текущую папку и историю
+    в глобальное состояние и собирает вывод. Возвращает (вывод, завершить ли сессию).
+    """
+    global command_history
+    params['current_working_directory'] = session.cwd
+    command_history = session.history
+    if session.view is not None:                                        # сессия в песочнице — подставляем ее дерево
+        cow['saved'] = capture_view()
+        activate_view(session.view)
+    output = io.StringIO()
+    finished = False
+    server_state['remote'] = True
+    with contextlib.redirect_stdout(output):
+        try:
+            do_command(line)
+        except SystemExit:                                              # exit завершает только сессию, а не сервер
+            finished = True
+        except Exception as e:                                          # как в repl: сообщаем, но сессию не закрываем
+            print(f"Внутренняя ошибка: {e}")
+        finally:
+            server_state['remote'] = False
+    session.cwd = params['current_working_directory']                   # cd заменяет список целиком
+    session.view = None
+    if cow['private']:                                                  # между командами активно общее дерево
+        session.view = capture_view()
+        activate_view(cow['saved'])
+        cow['saved'] = None
+    return output.getvalue(), finished
+
+
+def session_prompt(session):
+    params['current_working_directory'] = session.cwd
+    return make_invite_line()
+
+
+async def handle_session(reader, writer):
+    """
+    Обслуживает одно подключение: читает строки команд и отвечает выводом и приглашением.
+    """
+    session = Session()
+    server_state['sessions'] += 1
+    try:
+        writer.write((session_prompt(session) + '\0').encode('utf-8'))
+        while True:
+            await writer.drain()
+            line = await reader.readline()
+            if not line:                                                # клиент отключился
+                break
+            output, finished = session_command(session, line.decode('utf-8', 'replace').rstrip('\r\n'))
+            if finished:
+                writer.write((output + '\0').encode('utf-8'))
+                await writer.drain()
+                break
+            writer.write((output + session_prompt(session) + '\0').encode('utf-8'))
+    except ConnectionError:
+        pass
+    finally:
+        server_state['sessions'] -= 1
+        writer.close()
+
+
+async def serve(address):
+    """
+    Принимает сессии по адресу address: 'хост:порт' (TCP) или 'unix:путь' (Unix-сокет).
+    """
+    import asyncio                                                      # нужен только режиму сервера
+    if address.startswith('unix:'):
+        path = address[5:]
+        with contextlib.suppress(FileNotFoundError):                    # сокет, оставшийся от прошлого запуска
+            os.unlink(path)
+        server = await asyncio.start_unix_server(handle_session, path)
+    else:
+        host, _, port = address.rpartition(':')
+        server = await asyncio.start_server(handle_session, host or '127.0.0.1', int(port))
+    print(f"Сервер VFS: {address}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+@command('sessions')
+def handle_sessions(args):
+    """
+    sessions — число открытых сессий сервера
+    """
+    print(f"Сессий: {server_state['sessions']}")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()                                  # парсер аргументов вызываемый при старте файла
 
     parser.add_argument('--vfs', default=None)             # параметр --vfs - путь к VFS (по умолчанию текущая директория)
     parser.add_argument('--prompt', default=None)          # параметр --prompt: кастомное приглашение к вводу
     parser.add_argument('--script', default=None)          # параметр --script: путь к стартовому скрипту
+    parser.add_argument('--plugin', action='append', default=[])  # параметр --plugin: модуль со сторонними командами (можно несколько раз)
+    parser.add_argument('--quiet', action='store_true')    # параметр --quiet: не выводить приглашение и строки скрипта
+    parser.add_argument('--lazy', action='store_true')     # параметр --lazy: монтировать папки VFS по мере обращения
+    parser.add_argument('--mount-all', action='store_true')  # параметр --mount-all: с --lazy сразу смонтировать всю VFS (как команда mount)
+    parser.add_argument('--compact-dirs', type=int, default=0)  # параметр --compact-dirs N: папки от N детей хранить в SortedChildren
+    parser.add_argument('--journal', action='store_true')  # параметр --journal: сохранять изменения VFS в журнал <vfs>.journal
+    parser.add_argument('--cache-dir', default=None)       # параметр --cache-dir: каталог для бинарных снимков VFS
+    parser.add_argument('--no-cache', action='store_true') # параметр --no-cache: не читать и не писать снимок
+    parser.add_argument('--blob-dir', default=None)        # параметр --blob-dir: каталог для крупного содержимого файлов (вне памяти процесса)
+    parser.add_argument('--serve', default=None)           # параметр --serve: адрес сервера сессий (хост:порт или unix:путь) вместо REPL
+    parser.add_argument('--private-sessions', action='store_true')  # параметр --private-sessions: каждая сессия сервера работает в своей песочнице
+    parser.add_argument('--undo', type=int, default=0)     # параметр --undo N: сколько последних изменяющих команд можно отменить командой undo
+    parser.add_argument('--profile', action='store_true')  # параметр --profile: трассировка памяти и отчет stats в stderr при выходе
 
     params_temp = parser.parse_args()                                   # получение параметров из командной строки
+    sys.modules.setdefault('main', sys.modules[__name__])               # модули команд делают import main и должны получить этот же модуль
 
     params = {                                                          # собираем параметры в словарь
         'vfs_path': os.path.abspath(params_temp.vfs) if params_temp.vfs else None,  # абсолютный путь, если путь не указан - None
         'prompt': params_temp.prompt,
-        'script_path': params_temp.script}
+        'script_path': params_temp.script,
+        'quiet': params_temp.quiet,
+        'lazy': params_temp.lazy,
+        'mount_all': params_temp.mount_all,
+        'compact_dirs': params_temp.compact_dirs,
+        'journal': params_temp.journal,
+        'cache': not params_temp.no_cache,
+        'cache_dir': params_temp.cache_dir,
+        'blob_dir': params_temp.blob_dir,
+        'serve': params_temp.serve,
+        'private_sessions': params_temp.private_sessions,
+        'undo_depth': params_temp.undo,
+        'profile': params_temp.profile}
     command_history = []                                                # список, в котором будут храниться команды
 
+    if params['profile']:                                               # память считается с самого начала, до загрузки VFS
+        import tracemalloc                                              # распределение памяти по строкам кода
+        tracemalloc.start()
+        atexit.register(report_profile)
+
+    plugins = [name for name in os.environ.get('VFS_SHELL_PLUGINS', '').split(',') if name]  # модули команд из окружения
+    load_plugins(plugins + params_temp.plugin)                          # и из параметров --plugin
+
     if params_temp.vfs != None:                                         # если путь к vfs указан
         vfs = load_vfs()                                                # загрузка vfs при старте эмулятора
         params['vfs'] = vfs                                             # сохраняем загруженную vfs в параметрах для дальнейшего использования
+        if vfs is not None and params['lazy'] and params['mount_all']:  # полная загрузка без разбора XML по ходу работы
+            mount_all()
         params['current_working_directory'] = ['root']                  # записываем текущую рабочую папку
         print("Простой эмулятор оболочки по заданию 2")                 # отладочный вывод заданных параметров
     else:
@@ -410,4 +3302,12 @@ if __name__ == "__main__":
         if not run_script():                                            # если выполнение завершается ошибкой
             sys.exit(1)                                                 # завершаем программу
 
+    if params['serve'] is not None:                                     # режим сервера: одна VFS на все сессии
+        import asyncio                                                  # сервер сессий
+        try:
+            asyncio.run(serve(params['serve']))
+        except KeyboardInterrupt:
+            print("\nexit")
+        sys.exit(0)
+
     repl()
\ No newline at end of file
@@ -0,0 +1,2 @@
+compact
+exit
\ No newline at end of file
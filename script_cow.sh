@@ -0,0 +1,26 @@
+find -name 'lesson*'
+snapshot before
+mv /docs/tutorials/lesson1.txt /bin
+chown SJ /bin/lesson1.txt
+find -name 'lesson*'
+find -user SJ
+ls /bin
+snapshot -l
+undo
+find -user SJ
+ls /bin
+rollback before
+find -name 'lesson*'
+ls /bin
+cp -r /docs /home/user
+find -name 'manual*'
+du -s /
+undo
+find -name 'manual*'
+du -s /
+sandbox on
+mv /readme.txt /bin
+find -name 'readme*'
+sandbox off
+find -name 'readme*'
+exit
\ No newline at end of file
@@ -0,0 +1,20 @@
+cp /readme.txt /bin/img_1.png
+cp /readme.txt /bin/img_2.png
+cp /readme.txt /bin/img_3.png
+cp /readme.txt /bin/note.txt
+ls /bin
+ls --limit 2 /bin
+ls --offset 2 --limit 2 /bin
+ls /bin/img_*
+ls -l /bin 'img_[12].png'
+mv '/docs/tutorials/*.txt' /home/user/projects
+ls /docs/tutorials
+ls /home/user/projects
+mv '/bin/img_*.png' '/bin/pic_*.png'
+ls /bin
+chown SJ '/bin/pic_*'
+ls --owner SJ /bin
+chown -R ICE_CUBE '/home/user/*'
+find -user ICE_CUBE
+du -s /
+exit
\ No newline at end of file
@@ -0,0 +1,7 @@
+ls /bin
+ls /docs/tutorials
+ls /home/user/projects
+find -user SJ
+find -user ICE_CUBE
+du -s /
+exit
\ No newline at end of file
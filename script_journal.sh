@@ -0,0 +1,12 @@
+mv /readme.txt /docs
+cp /docs/manual.pdf /bin/manual_copy.pdf
+mv /docs/manual.pdf /
+cp -r /docs/tutorials /home/user
+chown SJ /home/user/tutorials
+chown -R ICE_CUBE /home/user/projects
+mv /bin /home/user/tools
+chown SJ /docs/readme.txt
+undo
+ls /
+ls /docs
+exit
\ No newline at end of file
@@ -0,0 +1,8 @@
+ls
+ls /docs
+ls /home/user
+ls -l /home/user/tools
+find -user SJ
+find -user ICE_CUBE
+du -s /
+exit
\ No newline at end of file
@@ -0,0 +1,134 @@
+import argparse                                                         # параметры генератора
+import base64                                                           # содержимое файлов в XML хранится в base64
+import random                                                           # воспроизводимая (--seed) случайная структура
+import sys
+from xml.sax.saxutils import quoteattr                                  # экранирование имен в атрибутах
+
+
+def parse_size_dist(spec):
+    """
+    Распределение размеров файлов по строке:
+    fixed:N — всегда N байт, uniform:A:B — равномерно от A до B, lognormal:MU:SIGMA — логнормальное
+    (много мелких файлов и редкие крупные, как в реальных образах).
+    Возвращает функцию rng -> размер.
+    """
+    kind, *args = spec.split(':')
+    try:
+        if kind == 'fixed':
+            (size,) = map(int, args)
+            return lambda rng: size
+        if kind == 'uniform':
+            low, high = map(int, args)
+            return lambda rng: rng.randint(low, high)
+        if kind == 'lognormal':
+            mu, sigma = map(float, args)
+            return lambda rng: int(rng.lognormvariate(mu, sigma))
+    except ValueError:
+        pass
+    raise ValueError(f"неизвестное распределение размеров: {spec}")
+
+
+class Generator:
+    """
+    Пишет XML VFS обходом в глубину, не строя дерево в памяти.
+    У каждой папки fanout вложенных папок (до глубины depth) и files файлов.
+    Владелец выбирается из owners имен (первое — root), доля dup_ratio файлов
+    получает содержимое из небольшого пула уже созданного (дубликаты).
+    """
+
+    def __init__(self, out, depth, fanout, files, size_dist, owners, dup_ratio, max_nodes, seed, pool_size=64):
+        self.out = out
+        self.depth = depth
+        self.fanout = fanout
+        self.files = files
+        self.size_dist = size_dist
+        self.owners = ['root'] + [f'user{i}' for i in range(1, owners)]
+        self.dup_ratio = dup_ratio
+        self.max_nodes = max_nodes
+        self.rng = random.Random(seed)
+        self.pool = []                                                  # base64 уже созданного содержимого для дубликатов
+        self.pool_size = pool_size
+        self.nodes = 0
+        self.bytes = 0
+
+    def owner_attr(self):
+        owner = self.rng.choice(self.owners)
+        return '' if owner == 'root' else f' owner={quoteattr(owner)}'
+
+    def payload(self):
+        if self.pool and self.rng.random() < self.dup_ratio:
+            encoded, size = self.rng.choice(self.pool)
+        else:
+            size = max(self.size_dist(self.rng), 0)
+            encoded = base64.b64encode(self.rng.randbytes(size)).decode('ascii')
+            if len(self.pool) < self.pool_size:
+                self.pool.append((encoded, size))
+            else:
+                self.pool[self.rng.randrange(self.pool_size)] = (encoded, size)
+        self.bytes += size
+        return encoded
+
+    def full(self):
+        return self.max_nodes and self.nodes >= self.max_nodes
+
+    def write_files(self, indent):
+        for i in range(self.files):
+            if self.full():
+                return
+            self.nodes += 1
+            self.out.write(f'{indent}<file name="f{i}.txt"{self.owner_attr()}>{self.payload()}</file>\n')
+
+    def write(self):
+        """
+        Пишет весь образ. Корень содержит home/user (домашняя папка оболочки) и дерево папок d0, d1, ...
+        """
+        self.out.write('<filesystem>\n    <folder name="root">\n')
+        self.out.write('        <folder name="home">\n            <folder name="user">\n')
+        self.nodes += 3
+        self.write_files(' ' * 16)
+        self.out.write('            </folder>\n        </folder>\n')
+
+        stack = [(0, i) for i in reversed(range(self.fanout))]          # (глубина, номер папки); None — закрыть папку
+        depth_of_open = 0
+        while stack:
+            entry = stack.pop()
+            if entry is None:
+                depth_of_open -= 1
+                self.out.write(f"{'    ' * (depth_of_open + 2)}</folder>\n")
+                continue
+            level, number = entry
+            if self.full():
+                continue
+            indent = '    ' * (level + 2)
+            self.nodes += 1
+            self.out.write(f'{indent}<folder name="d{number}"{self.owner_attr()}>\n')
+            depth_of_open += 1
+            self.write_files(indent + '    ')
+            stack.append(None)
+            if level + 1 < self.depth:
+                stack.extend((level + 1, i) for i in reversed(range(self.fanout)))
+        self.out.write('    </folder>\n</filesystem>\n')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Генератор синтетических XML VFS для нагрузочных замеров')
+    parser.add_argument('--out', default='-')               # файл XML ('-' — stdout)
+    parser.add_argument('--depth', type=int, default=4)     # глубина дерева папок
+    parser.add_argument('--fanout', type=int, default=8)    # вложенных папок в каждой папке
+    parser.add_argument('--files', type=int, default=16)    # файлов в каждой папке
+    parser.add_argument('--size-dist', default='lognormal:5:1.5')  # распределение размеров файлов (см. parse_size_dist)
+    parser.add_argument('--owners', type=int, default=4)    # число разных владельцев
+    parser.add_argument('--dup-ratio', type=float, default=0.3)  # доля файлов с повторяющимся содержимым
+    parser.add_argument('--max-nodes', type=int, default=0)  # предел числа узлов (0 — без предела)
+    parser.add_argument('--seed', type=int, default=1)      # зерно генератора: одинаковые параметры дают одинаковый XML
+
+    args = parser.parse_args()
+    out = sys.stdout if args.out == '-' else open(args.out, 'w', encoding='utf-8')
+    try:
+        generator = Generator(out, args.depth, args.fanout, args.files, parse_size_dist(args.size_dist),
+                              args.owners, args.dup_ratio, args.max_nodes, args.seed)
+        generator.write()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"Узлов: {generator.nodes}, байт содержимого: {generator.bytes}", file=sys.stderr)